@@ -1,195 +1,684 @@
+import atexit
+import io
 import json
 import logging
+import queue
+import threading
+import time
+import uuid
+import orjson
+from collections import Counter
 from datetime import datetime, timedelta
 from django.core.cache import cache
-from django.db import transaction, connections
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import DataError, IntegrityError, transaction, connections
+from django.db.models import Case, F, IntegerField, JSONField, Q, Value, When
 from django.utils import timezone
 from redis import Redis
 from .models import Website, Visitor, Session, PageView, CustomEvent
-from .utils import parse_user_agent, get_traffic_source, get_location_from_ip
+from .utils import parse_user_agent, get_traffic_source, get_domain_from_url, get_locations_for_ips
 
 logger = logging.getLogger(__name__)
 
+# Errors caused by the content of an event. Only these are bisected down to
+# the offending events and count towards MAX_EVENT_RETRIES; anything else
+# (a database or Redis outage, say) fails the whole batch, which is then
+# requeued unchanged while the processor backs off.
+EVENT_DATA_ERRORS = (IntegrityError, DataError, ValidationError, ValueError, TypeError, KeyError)
+
+def encode_event(event_data):
+    """Serialize an event for the Redis queue"""
+    return orjson.dumps(event_data, default=str)
+
+def get_event_ip(event_data):
+    """Client IP recorded on a queued event"""
+    return event_data.get('client_ip') or event_data.get('ip_address')
+
+def decode_event(raw_event):
+    """Deserialize an event popped from the Redis queue"""
+    try:
+        return orjson.loads(raw_event)
+    except orjson.JSONDecodeError:
+        # Entries queued by the old stdlib encoder may contain NaN/Infinity
+        return json.loads(raw_event)
+
+def get_website_id(tracking_id):
+    """
+    Resolve a tracking ID to its active website's primary key. Cached in the
+    shared cache (misses only briefly) and cleared whenever the Website is
+    saved or deleted; raises Website.DoesNotExist for unknown or inactive IDs.
+    """
+    cache_key = f"website:{tracking_id}"
+    cached = cache.get(cache_key)
+    if cached is None:
+        website_id = Website.objects.filter(
+            tracking_id=tracking_id, is_active=True
+        ).values_list('id', flat=True).first()
+        cached = {'id': website_id, 'active': website_id is not None}
+        cache.set(cache_key, cached, timeout=3600 if cached['active'] else 300)
+    
+    if not cached['active']:
+        raise Website.DoesNotExist(f"No active website for tracking_id {tracking_id}")
+    return cached['id']
+
+def get_website_ids(tracking_ids):
+    """
+    Resolve many tracking IDs at once: one cache read for all of them and a
+    single query for the misses. Unknown or inactive IDs are left out.
+    """
+    keys = {f"website:{tracking_id}": tracking_id for tracking_id in tracking_ids}
+    resolved = {keys[key]: cached for key, cached in cache.get_many(list(keys)).items()}
+    
+    missing = {}
+    for tracking_id in tracking_ids:
+        if tracking_id in resolved:
+            continue
+        try:
+            missing[str(uuid.UUID(str(tracking_id)))] = tracking_id
+        except ValueError:
+            resolved[tracking_id] = {'id': None, 'active': False}
+    
+    if missing:
+        found = {
+            str(tracking_id): website_id for tracking_id, website_id in
+            Website.objects.filter(
+                tracking_id__in=list(missing), is_active=True
+            ).values_list('tracking_id', 'id')
+        }
+        fetched = {
+            tracking_id: {'id': found.get(key), 'active': key in found}
+            for key, tracking_id in missing.items()
+        }
+        resolved.update(fetched)
+        cache.set_many({
+            f"website:{tracking_id}": cached
+            for tracking_id, cached in fetched.items() if cached['active']
+        }, timeout=3600)
+        cache.set_many({
+            f"website:{tracking_id}": cached
+            for tracking_id, cached in fetched.items() if not cached['active']
+        }, timeout=300)
+    
+    return {tracking_id: cached['id'] for tracking_id, cached in resolved.items() if cached['active']}
+
 class BatchEventProcessor:
     """
     Handles batch processing of analytics events to reduce database load
     """
+    # In-process buffer shared by every instance. The request path only
+    # enqueues here; a daemon thread ships the events to Redis in batches.
+    _buffer = queue.Queue(maxsize=10000)
+    _flusher = None
+    _flusher_lock = threading.Lock()
+    flush_size = 100
+    flush_interval = 0.05  # seconds
+    
     def __init__(self):
-        self.redis_client = Redis.from_url('redis://localhost:6379/0')
-        self.batch_size = 100
+        self.redis_client = Redis.from_url(settings.REDIS_URL)
+        self.batch_size = settings.TRACKER_SETTINGS['BATCH_SIZE']
         self.event_queue_key = 'analytics:event_queue'
-        self.processing_lock_key = 'analytics:processing_lock'
+        self.dead_letter_key = 'analytics:event_dead_letter'
+        self.max_event_retries = settings.TRACKER_SETTINGS['MAX_EVENT_RETRIES']
+        
+        # Back-off state after batch-wide failures (outages, not bad events)
+        self.failed_batches = 0
+        self.resume_at = 0.0
+        self.max_backoff_seconds = 60
     
     def queue_event(self, event_data):
-        """Queue an event for batch processing"""
+        """Queue an event for batch processing without waiting on Redis"""
+        blob = self.prepare_event(event_data)
+        self.start_flusher()
         try:
-            # Add timestamp if not present
-            if 'queued_at' not in event_data:
-                event_data['queued_at'] = timezone.now().isoformat()
-            
-            # Push to Redis queue
-            self.redis_client.lpush(
-                self.event_queue_key, 
-                json.dumps(event_data, default=str)
-            )
-            
-            # Trigger processing if queue is getting full
-            queue_length = self.redis_client.llen(self.event_queue_key)
-            if queue_length >= self.batch_size:
-                self.process_batch()
-                
+            self._buffer.put_nowait(blob)
+            return True
+        except queue.Full:
+            # Flusher is falling behind; push this one synchronously
+            return self.push_events([blob])
+    
+    def queue_events(self, events):
+        """Queue several events using a single Redis round-trip"""
+        return self.push_events([self.prepare_event(event_data) for event_data in events])
+    
+    def prepare_event(self, event_data):
+        """Stamp and serialize an event for the queue"""
+        # Epoch seconds: no timezone handling or string formatting per event
+        event_data.setdefault('queued_at', time.time())
+        
+        # Most optional fields arrive blank; dropping them keeps payloads small
+        # and leaves fewer keys to decode. Readers use .get() with defaults.
+        compact = {
+            key: value for key, value in event_data.items()
+            if value not in (None, '', {})
+        }
+        return encode_event(compact)
+    
+    def push_events(self, blobs):
+        """Push serialized events to Redis with one variadic LPUSH"""
+        try:
+            self.redis_client.lpush(self.event_queue_key, *blobs)
             return True
         except Exception as e:
-            logger.error(f"Failed to queue event: {e}")
+            logger.error(f"Failed to queue events: {e}")
             # Fallback to immediate processing
-            return self.process_single_event(event_data)
+            return all([self.process_single_event(decode_event(blob)) for blob in blobs])
+    
+    def start_flusher(self):
+        """Start the background flusher thread once per process"""
+        cls = type(self)
+        if cls._flusher is not None:
+            return
+        with cls._flusher_lock:
+            if cls._flusher is None:
+                cls._flusher = threading.Thread(
+                    target=self.flush_forever, name='analytics-flusher', daemon=True
+                )
+                cls._flusher.start()
+                atexit.register(self.flush_pending)
+    
+    def flush_forever(self):
+        """Ship buffered events to Redis every flush_size events or flush_interval"""
+        while True:
+            blobs = [self._buffer.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(blobs) < self.flush_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    blobs.append(self._buffer.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.push_events(blobs)
+    
+    def flush_pending(self):
+        """Push whatever is still buffered, e.g. at interpreter exit"""
+        blobs = []
+        while True:
+            try:
+                blobs.append(self._buffer.get_nowait())
+            except queue.Empty:
+                break
+        if blobs:
+            self.push_events(blobs)
+    
+    def process_single_event(self, event_data):
+        """Process one event immediately, bypassing the Redis queue"""
+        try:
+            # Normalise to the same shape the queue would have produced
+            event = orjson.loads(encode_event(event_data))
+            if event.get('event_type') == 'session_end':
+                self.process_session_ends([event])
+            else:
+                self.process_website_batch(event.get('tracking_id'), [event])
+            return True
+        except Exception as e:
+            logger.error(f"Failed to process event: {e}")
+            return False
     
     def process_batch(self):
         """Process a batch of events"""
-        # Acquire processing lock to prevent concurrent processing
-        if not self.redis_client.set(self.processing_lock_key, '1', nx=True, ex=30):
+        if time.monotonic() < self.resume_at:
+            # Backing off after a batch-wide failure; leave the queue alone
+            return False
+        try:
+            # Pop a batch from the tail (oldest first) in one atomic command.
+            # Each worker owns whatever it pops, so no lock is needed.
+            raw_events = self.redis_client.rpop(self.event_queue_key, self.batch_size) or []
+        except Exception as e:
+            logger.error(f"Failed to pop events: {e}")
             return False
+        return self.process_raw_events(raw_events)
+    
+    def wait_and_process_batch(self, timeout=5):
+        """
+        Block until at least one event is queued (or timeout seconds pass),
+        then process it together with whatever else is waiting
+        """
+        time.sleep(max(0, self.resume_at - time.monotonic()))
+        popped = self.redis_client.brpop(self.event_queue_key, timeout=timeout)
+        if popped is None:
+            return True
+        _, first_event = popped
+        rest = self.redis_client.rpop(self.event_queue_key, self.batch_size - 1) or []
+        return self.process_raw_events([first_event, *rest])
+    
+    def process_raw_events(self, raw_events):
+        """Decode and process events popped from the queue"""
+        events = []
+        for event_data in raw_events:
+            try:
+                events.append(decode_event(event_data))
+            except Exception as e:
+                logger.error(f"Undecodable event: {e}")
+                self.dead_letter([event_data])
+        
+        if not events:
+            return True
+        
+        # Process events in batches by website
+        events_by_website = {}
+        session_ends = []
+        for event in events:
+            if event.get('event_type') == 'session_end':
+                session_ends.append(event)
+                continue
+            tracking_id = event.get('tracking_id')
+            if tracking_id not in events_by_website:
+                events_by_website[tracking_id] = []
+            events_by_website[tracking_id].append(event)
         
+        processed = []
+        failed = []
         try:
-            events = []
-            # Get batch of events
-            for _ in range(self.batch_size):
-                event_data = self.redis_client.rpop(self.event_queue_key)
-                if not event_data:
-                    break
-                events.append(json.loads(event_data))
-            
-            if not events:
-                return True
+            # Resolve every website the batch still needs with one cache round-trip
+            website_ids = get_website_ids([
+                tracking_id for tracking_id, website_events in events_by_website.items()
+                if tracking_id is not None and not website_events[0].get('website_id')
+            ])
             
-            # Process events in batches by website
-            events_by_website = {}
-            for event in events:
-                tracking_id = event.get('tracking_id')
-                if tracking_id not in events_by_website:
-                    events_by_website[tracking_id] = []
-                events_by_website[tracking_id].append(event)
-            
-            # Process each website's events in a transaction
+            # Process each website's events in a transaction; an event with bad
+            # data is isolated so it can't hold back the rest of the batch
             for tracking_id, website_events in events_by_website.items():
-                self.process_website_batch(tracking_id, website_events)
-            
-            logger.info(f"Processed batch of {len(events)} events")
-            return True
+                self.process_isolated(
+                    lambda chunk: self.process_website_batch(tracking_id, chunk, website_ids.get(tracking_id)),
+                    website_events, processed, failed
+                )
             
+            if session_ends:
+                self.process_isolated(self.process_session_ends, session_ends, processed, failed)
         except Exception as e:
-            logger.error(f"Batch processing failed: {e}")
-            # Put events back in queue
-            for event in events:
-                self.redis_client.lpush(self.event_queue_key, json.dumps(event, default=str))
+            # Not the events' fault: put back everything that wasn't stored,
+            # as it was, and give the database or Redis time to recover
+            handled = {id(event) for event in processed + failed}
+            unprocessed = [event for event in events if id(event) not in handled]
+            logger.error(f"Batch processing failed, requeueing {len(unprocessed)} events: {e}")
+            self.requeue_events(unprocessed)
+            self.retry_events(failed)
+            self.back_off()
             return False
-        finally:
-            self.redis_client.delete(self.processing_lock_key)
+        
+        self.failed_batches = 0
+        if failed:
+            self.retry_events(failed)
+        
+        logger.info(f"Processed batch of {len(processed)} events ({len(failed)} failed)")
+        return not failed
     
-    @transaction.atomic
-    def process_website_batch(self, tracking_id, events):
+    def process_isolated(self, process, events, processed, failed):
+        """
+        Run process(events) and, if the events' data makes it fail, bisect
+        them until the failing ones are found. Events end up in processed or
+        failed; any other error is raised for the whole batch.
+        """
+        try:
+            process(events)
+            processed.extend(events)
+            return
+        except EVENT_DATA_ERRORS as e:
+            if len(events) == 1:
+                logger.error(f"Event processing failed: {e}")
+                failed.extend(events)
+                return
+        
+        middle = len(events) // 2
+        self.process_isolated(process, events[:middle], processed, failed)
+        self.process_isolated(process, events[middle:], processed, failed)
+    
+    def requeue_events(self, events):
+        """Put events back at the tail, to be popped next in their original order"""
+        if not events:
+            return
+        try:
+            self.redis_client.rpush(self.event_queue_key, *(encode_event(event) for event in reversed(events)))
+        except Exception as e:
+            logger.error(f"Failed to requeue {len(events)} events: {e}")
+    
+    def back_off(self):
+        """Pause batch processing, doubling the pause after each consecutive failed batch"""
+        self.failed_batches += 1
+        delay = min(self.max_backoff_seconds, 2 ** (self.failed_batches - 1))
+        self.resume_at = time.monotonic() + delay
+        logger.warning(f"Pausing batch processing for {delay}s")
+    
+    def retry_events(self, events):
+        """
+        Requeue events whose data failed at the head of the queue, behind
+        everything already waiting. Events that keep failing go to the
+        dead-letter list.
+        """
+        if not events:
+            return
+        requeue = []
+        exhausted = []
+        for event in events:
+            attempts = event.get('attempts', 0) + 1
+            if attempts >= self.max_event_retries:
+                exhausted.append(encode_event(event))
+            else:
+                requeue.append(encode_event({**event, 'attempts': attempts}))
+        
+        try:
+            if requeue:
+                self.redis_client.lpush(self.event_queue_key, *requeue)
+        except Exception as e:
+            logger.error(f"Failed to requeue {len(requeue)} events: {e}")
+        if exhausted:
+            self.dead_letter(exhausted)
+    
+    def dead_letter(self, raw_events):
+        """Park events that can't be processed where they can be inspected"""
+        logger.warning(f"Moving {len(raw_events)} events to {self.dead_letter_key}")
+        try:
+            self.redis_client.lpush(self.dead_letter_key, *raw_events)
+        except Exception as e:
+            logger.error(f"Failed to dead-letter {len(raw_events)} events: {e}")
+    
+    def process_website_batch(self, tracking_id, events, website_id=None):
         """Process events for a single website in a transaction"""
         try:
-            website = Website.objects.select_related().get(
-                tracking_id=tracking_id, is_active=True
-            )
+            # Ingest resolves the website up front and ships its id with the event
+            website_id = website_id or events[0].get('website_id') or get_website_id(tracking_id)
         except Website.DoesNotExist:
             logger.warning(f"Website not found for tracking_id: {tracking_id}")
             return
         
+        # Sessions are looked up first: only new ones need UA parsing and geolocation.
+        # session_id is unique per website only, so in_bulk() can't key on it.
+        session_ids = {event_data.get('session_id') for event_data in events}
+        existing_sessions = {
+            session.session_id: session for session in
+            Session.objects.filter(
+                website_id=website_id, session_id__in=session_ids
+            ).only('id', 'session_id')
+        }
+        
+        # Geolocate the IPs of every new session in one batched lookup. This can
+        # go over the network, so it runs before the transaction is opened.
+        locations = get_locations_for_ips({
+            get_event_ip(event_data) for event_data in events
+            if event_data.get('session_id') not in existing_sessions
+        })
+        
         # Bulk create/update visitors, sessions, and events
-        self.bulk_process_events(website, events)
+        with transaction.atomic():
+            self.bulk_process_events(website_id, events, existing_sessions, locations)
     
-    def bulk_process_events(self, website, events):
-        """Bulk process events to minimize database queries"""
-        visitors_to_create = []
-        visitors_to_update = []
+    @transaction.atomic
+    def process_session_ends(self, events):
+        """Apply queued session end times with a single bulk UPDATE"""
+        # Keep only the latest end time reported for each session. session_id
+        # is only unique per website, so sessions are keyed by both.
+        ended_at_by_session = {}
+        for event_data in events:
+            website_id = event_data.get('website_id')
+            if not website_id:
+                try:
+                    website_id = get_website_id(event_data.get('tracking_id'))
+                except Website.DoesNotExist:
+                    logger.warning(f"Website not found for session end: {event_data.get('tracking_id')}")
+                    continue
+            key = (str(website_id), event_data.get('session_id'))
+            ended_at = datetime.fromisoformat(event_data['ended_at'])
+            if key not in ended_at_by_session or ended_at > ended_at_by_session[key]:
+                ended_at_by_session[key] = ended_at
+        
+        if not ended_at_by_session:
+            return
+        
+        session_ids_by_website = {}
+        for website_id, session_id in ended_at_by_session:
+            session_ids_by_website.setdefault(website_id, []).append(session_id)
+        session_filter = Q()
+        for website_id, session_ids in session_ids_by_website.items():
+            session_filter |= Q(website_id=website_id, session_id__in=session_ids)
+        
+        sessions = list(
+            Session.objects.filter(session_filter)
+            .only('id', 'website_id', 'session_id', 'started_at')
+        )
+        for session in sessions:
+            session.ended_at = ended_at_by_session[(str(session.website_id), session.session_id)]
+            if session.started_at:
+                duration = (session.ended_at - session.started_at).total_seconds()
+                session.duration_seconds = int(duration)
+        
+        if sessions:
+            Session.objects.fast_update(sessions, ['ended_at', 'duration_seconds'])
+    
+    def bulk_process_events(self, website_id, events, existing_sessions, locations):
+        """
+        Bulk process events to minimize database queries. existing_sessions
+        maps the batch's stored session ids to their sessions; locations maps
+        the client IPs of new sessions to their location info.
+        """
         sessions_to_create = []
         pageviews_to_create = []
         custom_events_to_create = []
         
-        # Cache for visitor and session lookups
-        visitor_cache = {}
+        now = timezone.now()
+        
+        # Cache for session lookups
         session_cache = {}
         
+        # Per-batch memo for UA parsing, geolocation and traffic source,
+        # which repeat heavily within a batch
+        lookup_cache = {}
+        
+        # Create or refresh every visitor in this batch with a single upsert
+        visitor_ids = {event_data.get('visitor_id') for event_data in events}
+        visitors = self.upsert_visitors(website_id, visitor_ids, now)
+        
+        # Resolve each event's session first, so new sessions are stored and
+        # carry their database ids before any event references them
+        event_sessions = []
         for event_data in events:
             visitor_id = event_data.get('visitor_id')
             session_id = event_data.get('session_id')
             
-            # Handle visitor
-            if visitor_id not in visitor_cache:
-                visitor, created = self.get_or_prepare_visitor(
-                    website, visitor_id, visitors_to_create, visitors_to_update
-                )
-                visitor_cache[visitor_id] = visitor
-            else:
-                visitor = visitor_cache[visitor_id]
-            
-            # Handle session
             session_key = f"{visitor_id}:{session_id}"
             if session_key not in session_cache:
-                session = self.get_or_prepare_session(
-                    website, visitor, session_id, event_data, sessions_to_create
+                session_cache[session_key] = self.get_or_prepare_session(
+                    website_id, visitors[visitor_id], session_id, event_data,
+                    existing_sessions, sessions_to_create, locations, lookup_cache
                 )
-                session_cache[session_key] = session
-            else:
-                session = session_cache[session_key]
+            event_sessions.append(session_cache[session_key])
+        
+        if sessions_to_create:
+            self.create_sessions(website_id, sessions_to_create)
+        
+        for event_data, session in zip(events, event_sessions):
+            visitor = visitors[event_data.get('visitor_id')]
             
             # Handle event
             if event_data.get('event_type') == 'pageview':
-                pageview = self.prepare_pageview(website, session, visitor, event_data)
+                pageview = self.prepare_pageview(website_id, session, visitor, event_data, lookup_cache)
                 pageviews_to_create.append(pageview)
             elif event_data.get('event_type') == 'custom':
-                custom_event = self.prepare_custom_event(website, session, visitor, event_data)
+                custom_event = self.prepare_custom_event(website_id, session, visitor, event_data)
                 custom_events_to_create.append(custom_event)
         
-        # Bulk create/update
-        if visitors_to_create:
-            Visitor.objects.bulk_create(visitors_to_create, ignore_conflicts=True)
+        # Bulk create
+        if pageviews_to_create:
+            self.copy_insert(PageView, pageviews_to_create)
+            self.increment_session_page_views(
+                Counter(pageview.session_id for pageview in pageviews_to_create)
+            )
         
-        if visitors_to_update:
-            Visitor.objects.bulk_update(visitors_to_update, ['last_seen', 'is_returning'])
+        if custom_events_to_create:
+            self.copy_insert(CustomEvent, custom_events_to_create)
+    
+    def create_sessions(self, website_id, sessions):
+        """
+        Insert new sessions in bulk, then read back the ids actually stored so
+        sessions a concurrent batch inserted first are referenced correctly
+        """
+        Session.objects.bulk_create(sessions, ignore_conflicts=True, batch_size=1000)
+        stored_ids = dict(Session.objects.filter(
+            website_id=website_id,
+            session_id__in=[session.session_id for session in sessions]
+        ).values_list('session_id', 'id'))
+        for session in sessions:
+            session.id = stored_ids.get(session.session_id, session.id)
+    
+    def increment_session_page_views(self, page_view_counts):
+        """Add each session's new page views with a single UPDATE"""
+        Session.objects.filter(pk__in=page_view_counts).update(
+            page_views=F('page_views') + Case(
+                *[When(pk=pk, then=Value(count)) for pk, count in page_view_counts.items()],
+                default=Value(0),
+                output_field=IntegerField()
+            )
+        )
+    
+    def copy_insert(self, model, objs):
+        """
+        Insert rows with PostgreSQL COPY FROM STDIN, which is considerably
+        faster than bulk_create's parameter binding for large batches.
+        Other backends fall back to bulk_create.
+        """
+        connection = connections['default']
+        if connection.vendor != 'postgresql':
+            model.objects.bulk_create(objs)
+            return
         
-        if sessions_to_create:
-            Session.objects.bulk_create(sessions_to_create, ignore_conflicts=True)
+        fields = model._meta.concrete_fields
+        buffer = io.StringIO()
+        for obj in objs:
+            row = []
+            for field in fields:
+                value = field.pre_save(obj, True)
+                if value is None:
+                    # An unquoted empty CSV value is NULL; quoted '' is a string
+                    row.append('')
+                    continue
+                if isinstance(field, JSONField):
+                    value = json.dumps(value, default=str)
+                row.append('"%s"' % str(value).replace('"', '""'))
+            buffer.write(','.join(row) + '\n')
+        buffer.seek(0)
         
-        if pageviews_to_create:
-            PageView.objects.bulk_create(pageviews_to_create)
+        table = connection.ops.quote_name(model._meta.db_table)
+        columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+    
+    def upsert_visitors(self, website_id, visitor_ids, now):
+        """
+        Insert new visitors and mark known ones as returning with a single
+        INSERT ... ON CONFLICT DO UPDATE ... RETURNING on PostgreSQL.
+        Returns visitors keyed by visitor_id, carrying their database ids.
+        """
+        if not visitor_ids:
+            return {}
         
-        if custom_events_to_create:
-            CustomEvent.objects.bulk_create(custom_events_to_create)
+        connection = connections['default']
+        if connection.vendor != 'postgresql':
+            return self.save_visitors(website_id, visitor_ids, now)
+        
+        params = []
+        for visitor_id in visitor_ids:
+            params.extend([str(uuid.uuid4()), str(website_id), visitor_id, now, now, now])
+        values = ', '.join(['(%s, %s, %s, %s, %s, false, %s)'] * len(visitor_ids))
+        
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {Visitor._meta.db_table} "
+                "(id, website_id, visitor_id, first_seen, last_seen, is_returning, started_at) "
+                f"VALUES {values} "
+                "ON CONFLICT (website_id, visitor_id) DO UPDATE "
+                "SET is_returning = true, last_seen = EXCLUDED.last_seen "
+                "RETURNING id, visitor_id",
+                params
+            )
+            rows = cursor.fetchall()
+        
+        return {
+            visitor_id: Visitor(id=pk, website_id=website_id, visitor_id=visitor_id)
+            for pk, visitor_id in rows
+        }
     
-    def get_or_prepare_visitor(self, website, visitor_id, to_create, to_update):
-        """Get existing visitor or prepare for bulk create/update"""
-        try:
-            visitor = Visitor.objects.get(website=website, visitor_id=visitor_id)
-            visitor.last_seen = timezone.now()
+    def save_visitors(self, website_id, visitor_ids, now):
+        """Portable fallback for upsert_visitors: select, then insert and update"""
+        # visitor_id is unique per website only, so in_bulk() can't key on it
+        visitors = {
+            visitor.visitor_id: visitor for visitor in
+            Visitor.objects.filter(
+                website_id=website_id, visitor_id__in=visitor_ids
+            ).only('id', 'visitor_id')
+        }
+        
+        for visitor in visitors.values():
+            visitor.last_seen = now
             visitor.is_returning = True
-            to_update.append(visitor)
-            return visitor, False
-        except Visitor.DoesNotExist:
-            visitor = Visitor(
-                website=website,
-                visitor_id=visitor_id,
-                first_seen=timezone.now(),
-                is_returning=False
-            )
-            to_create.append(visitor)
-            return visitor, True
+        if visitors:
+            Visitor.objects.fast_update(list(visitors.values()), ['last_seen', 'is_returning'])
+        
+        new_visitors = [
+            Visitor(website_id=website_id, visitor_id=visitor_id, first_seen=now, is_returning=False)
+            for visitor_id in visitor_ids if visitor_id not in visitors
+        ]
+        Visitor.objects.bulk_create(new_visitors, ignore_conflicts=True)
+        
+        visitors.update((visitor.visitor_id, visitor) for visitor in new_visitors)
+        return visitors
+    
+    def cached_lookup(self, lookup_cache, func, *args):
+        """Call func(*args) at most once per batch for the same arguments"""
+        key = (func, *args)
+        if key not in lookup_cache:
+            lookup_cache[key] = func(*args)
+        return lookup_cache[key]
+    
+    def get_or_prepare_session(self, website_id, visitor, session_id, event_data, existing_sessions, to_create, locations, lookup_cache):
+        """Get existing session or prepare for bulk create"""
+        session = existing_sessions.get(session_id)
+        if session is not None:
+            return session
+        
+        user_agent = event_data.get('user_agent', '')
+        ip_address = get_event_ip(event_data)
+        device_info = self.cached_lookup(lookup_cache, parse_user_agent, user_agent)
+        location_info = locations.get(ip_address, {})
+        
+        session = Session(
+            website_id=website_id,
+            visitor=visitor,
+            session_id=session_id,
+            user_agent=user_agent,
+            device_type=device_info.get('device_type', 'unknown'),
+            browser_name=device_info.get('browser_name', 'unknown'),
+            browser_version=device_info.get('browser_version', 'unknown'),
+            os_name=device_info.get('os_name', 'unknown'),
+            os_version=device_info.get('os_version', 'unknown'),
+            ip_address=ip_address,
+            country=location_info.get('country'),
+            region=location_info.get('region'),
+            city=location_info.get('city'),
+        )
+        to_create.append(session)
+        return session
     
-    def prepare_pageview(self, website, session, visitor, event_data):
+    def prepare_pageview(self, website_id, session, visitor, event_data, lookup_cache):
         """Prepare PageView object for bulk creation"""
-        page_path = event_data.get('page_url', '/').split('?')[0]
+        # Derived here rather than on ingest, so the request path never parses URLs
+        page_path = event_data.get('page_url', '/').partition('?')[0]
         
         return PageView(
-            website=website,
+            website_id=website_id,
             session=session,
             visitor=visitor,
             page_url=event_data.get('page_url', ''),
             page_title=event_data.get('page_title', ''),
             page_path=page_path,
             referrer_url=event_data.get('referrer_url'),
-            traffic_source=get_traffic_source(
+            referrer_domain=self.cached_lookup(
+                lookup_cache, get_domain_from_url, event_data.get('referrer_url')
+            ),
+            traffic_source=self.cached_lookup(
+                lookup_cache,
+                get_traffic_source,
                 event_data.get('referrer_url'),
                 event_data.get('utm_source'),
                 event_data.get('utm_medium')
@@ -205,3 +694,21 @@ class BatchEventProcessor:
             viewport_height=event_data.get('viewport_height'),
             timestamp=datetime.fromisoformat(event_data.get('timestamp').replace('Z', '+00:00'))
         )
+    
+    def prepare_custom_event(self, website_id, session, visitor, event_data):
+        """Prepare CustomEvent object for bulk creation"""
+        return CustomEvent(
+            website_id=website_id,
+            session=session,
+            visitor=visitor,
+            event_name=event_data.get('event_name', ''),
+            event_category=event_data.get('event_category'),
+            event_action=event_data.get('event_action'),
+            event_label=event_data.get('event_label'),
+            event_value=event_data.get('event_value'),
+            properties=event_data.get('properties', {}),
+        )
+
+# Process-wide instance so callers share one Redis connection pool instead of
+# building a client per request or per task run
+event_processor = BatchEventProcessor()
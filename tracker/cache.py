@@ -1,39 +1,56 @@
-from django.core.cache import cache
-from django.db.models import Count, Avg
 from datetime import timedelta
+from django.core.cache import cache
 from django.utils import timezone
+from functools import wraps
+from django.http import HttpResponse
+from .renderers import ORJSONRenderer
+from .utils import get_date_range
+
+# Ranges that ended before yesterday no longer change, so they are kept longer.
+# Yesterday still moves until the nightly rollup and late queued events land.
+HISTORICAL_CACHE_TIMEOUT = 60 * 60 * 24  # 24 hours
+
+def cached_analytics(timeout=60):
+    """
+    Cache a successful analytics response per user, website and query string.
+    Requests for a range ending before yesterday are cached for a day; anything
+    touching yesterday or today (including the default range) only for
+    `timeout` seconds. invalidate_website_caches() drops a website's entries.
+    The rendered JSON is stored, so a hit is returned as-is without
+    rebuilding or re-serializing the data.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, website_id, *args, **kwargs):
+            today = timezone.now().date()
+            version = cache.get(f"cache_version:{website_id}", 0)
+            # The user is part of the key so a hit never skips the ownership check
+            cache_key = (
+                f"analytics:{view.__name__}:{request.user.pk}:{website_id}:{version}:"
+                f"{today}:{request.GET.urlencode()}"
+            )
+            payload = cache.get(cache_key)
+            if payload is not None:
+                return HttpResponse(payload, content_type='application/json')
+            
+            response = view(request, website_id, *args, **kwargs)
+            if response.status_code == 200:
+                # The range the view actually used, with the same fallbacks
+                _, end_date = get_date_range(request)
+                cache.set(
+                    cache_key,
+                    ORJSONRenderer().render(response.data),
+                    HISTORICAL_CACHE_TIMEOUT if end_date < today - timedelta(days=1) else timeout
+                )
+            return response
+        return wrapper
+    return decorator
 
-class AnalyticsCache:
-    """Caching layer for analytics queries"""
-    
-    def __init__(self):
-        self.default_timeout = 300  # 5 minutes
-    
-    def get_overview_stats(self, website, start_date, end_date):
-        """Get cached overview stats"""
-        cache_key = f"overview:{website.id}:{start_date}:{end_date}"
-        stats = cache.get(cache_key)
-        
-        if stats is None:
-            # Calculate stats
-            stats = self._calculate_overview_stats(website, start_date, end_date)
-            cache.set(cache_key, stats, self.default_timeout)
-        
-        return stats
-    
-    def get_top_pages(self, website, start_date, end_date):
-        """Get cached top pages"""
-        cache_key = f"top_pages:{website.id}:{start_date}:{end_date}"
-        pages = cache.get(cache_key)
-        
-        if pages is None:
-            pages = self._calculate_top_pages(website, start_date, end_date)
-            cache.set(cache_key, pages, self.default_timeout)
-        
-        return pages
-    
-    def invalidate_website_cache(self, website_id):
-        """Invalidate all cache entries for a website"""
-        # This would require a more sophisticated cache key pattern
-        # For now, we can use cache versioning
-        cache.set(f"cache_version:{website_id}", timezone.now().timestamp())
+def invalidate_website_caches(website_ids):
+    """
+    Drop every cached analytics response for the given websites. The version
+    is part of every key, so bumping it orphans the old entries in O(1); they
+    expire on their own timeout.
+    """
+    version = timezone.now().timestamp()
+    cache.set_many({f"cache_version:{website_id}": version for website_id in website_ids}, None)
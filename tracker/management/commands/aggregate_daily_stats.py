@@ -1,8 +1,9 @@
 from django.core.management.base import BaseCommand
 from django.db.models import Count, Avg, Q
 from django.utils import timezone
-from datetime import timedelta
-from analytics.models import Website, PageView, Session, Visitor, DailyStats
+from datetime import datetime, time, timedelta
+from tracker.cache import invalidate_website_caches
+from tracker.models import Website, PageView, Session, Visitor, DailyStats
 
 class Command(BaseCommand):
     help = 'Aggregate daily statistics for all websites'
@@ -13,88 +14,122 @@ class Command(BaseCommand):
             type=str,
             help='Date to aggregate (YYYY-MM-DD format). Defaults to yesterday.',
         )
+        parser.add_argument(
+            '--since',
+            type=str,
+            help='Backfill every day from this date (YYYY-MM-DD format) through --date.',
+        )
     
     def handle(self, *args, **options):
         if options['date']:
-            from datetime import datetime
             target_date = datetime.strptime(options['date'], '%Y-%m-%d').date()
         else:
             target_date = (timezone.now() - timedelta(days=1)).date()
         
-        self.stdout.write(f'Aggregating stats for {target_date}')
+        if options['since']:
+            first_date = datetime.strptime(options['since'], '%Y-%m-%d').date()
+        else:
+            first_date = target_date
         
-        websites = Website.objects.filter(is_active=True)
+        website_ids = list(
+            Website.objects.filter(is_active=True).values_list('id', flat=True)
+        )
+        
+        day = first_date
+        while day <= target_date:
+            self.aggregate_day(day, website_ids)
+            day += timedelta(days=1)
         
-        for website in websites:
-            self.aggregate_website_stats(website, target_date)
+        # Cached responses for past ranges predate the new rows. Today's rows are
+        # refreshed every few minutes and only cached briefly, so leave those.
+        if first_date < timezone.localdate():
+            invalidate_website_caches(website_ids)
         
         self.stdout.write(
-            self.style.SUCCESS(f'Successfully aggregated stats for {websites.count()} websites')
+            self.style.SUCCESS(f'Successfully aggregated stats for {len(website_ids)} websites')
         )
     
-    def aggregate_website_stats(self, website, date):
-        # Page views
-        page_views = PageView.objects.filter(
-            website=website,
-            timestamp__date=date
-        ).count()
+    def aggregate_day(self, target_date, website_ids):
+        """Upsert one day's DailyStats rows for the given websites"""
+        self.stdout.write(f'Aggregating stats for {target_date}')
         
-        unique_page_views = PageView.objects.filter(
-            website=website,
-            timestamp__date=date
-        ).values('page_path').distinct().count()
+        # Half-open timestamp range so the (website, timestamp) indexes apply
+        day_start = timezone.make_aware(datetime.combine(target_date, time.min))
+        day_end = day_start + timedelta(days=1)
         
-        # Sessions
-        sessions_qs = Session.objects.filter(
-            website=website,
-            started_at__date=date
+        # One grouped query per model covers every website at once
+        page_view_stats = self.group_by_website(
+            PageView.objects.filter(website_id__in=website_ids, timestamp__gte=day_start, timestamp__lt=day_end),
+            page_views=Count('id'),
+            unique_page_views=Count('page_path', distinct=True)
         )
+        session_stats = self.group_by_website(
+            Session.objects.filter(website_id__in=website_ids, started_at__gte=day_start, started_at__lt=day_end),
+            sessions=Count('id'),
+            avg_duration=Avg('duration_seconds'),
+            bounces=Count('id', filter=Q(page_views=1))
+        )
+        visitor_stats = self.group_by_website(
+            Visitor.objects.filter(website_id__in=website_ids, first_seen__gte=day_start, first_seen__lt=day_end),
+            unique_visitors=Count('id'),
+            new_visitors=Count('id', filter=Q(is_returning=False))
+        )
+        
+        daily_stats = [
+            self.build_daily_stats(
+                website_id,
+                target_date,
+                page_view_stats.get(website_id, {}),
+                session_stats.get(website_id, {}),
+                visitor_stats.get(website_id, {}),
+            )
+            for website_id in website_ids
+        ]
         
-        sessions_count = sessions_qs.count()
-        avg_duration = sessions_qs.aggregate(
-            avg=Avg('duration_seconds')
-        )['avg'] or 0.0
+        # Upsert every website's row in a single INSERT ... ON CONFLICT
+        DailyStats.objects.bulk_create(
+            daily_stats,
+            update_conflicts=True,
+            unique_fields=['website', 'date'],
+            update_fields=[
+                'page_views', 'unique_page_views', 'sessions',
+                'avg_session_duration', 'bounce_rate', 'unique_visitors',
+                'new_visitors', 'returning_visitors', 'updated_at',
+            ],
+            batch_size=1000,
+        )
+    
+    def group_by_website(self, queryset, **aggregates):
+        """Run the aggregates grouped by website and key the rows by website id"""
+        rows = queryset.values('website_id').annotate(**aggregates).order_by()
+        return {row.pop('website_id'): row for row in rows}
+    
+    def build_daily_stats(self, website_id, date, page_view_stats, session_stats, visitor_stats):
+        # Page views
+        page_views = page_view_stats.get('page_views', 0)
+        unique_page_views = page_view_stats.get('unique_page_views', 0)
         
-        bounce_sessions = sessions_qs.filter(page_views=1).count()
-        bounce_rate = (bounce_sessions / sessions_count * 100) if sessions_count > 0 else 0.0
+        # Sessions
+        sessions_count = session_stats.get('sessions', 0)
+        avg_duration = session_stats.get('avg_duration') or 0.0
+        bounces = session_stats.get('bounces', 0)
+        bounce_rate = (bounces / sessions_count * 100) if sessions_count > 0 else 0.0
         
         # Unique visitors
-        unique_visitors = Visitor.objects.filter(
-            website=website,
-            first_seen__date=date
-        ).count()
-        
-        new_visitors = Visitor.objects.filter(
-            website=website,
-            first_seen__date=date,
-            is_returning=False
-        ).count()
+        unique_visitors = visitor_stats.get('unique_visitors', 0)
+        new_visitors = visitor_stats.get('new_visitors', 0)
         
         returning_visitors = unique_visitors - new_visitors
         
-        # Create or update daily stats
-        daily_stats, created = DailyStats.objects.get_or_create(
-            website=website,
+        return DailyStats(
+            website_id=website_id,
             date=date,
-            defaults={
-                'page_views': page_views,
-                'unique_page_views': unique_page_views,
-                'sessions': sessions_count,
-                'avg_session_duration': avg_duration,
-                'bounce_rate': bounce_rate,
-                'unique_visitors': unique_visitors,
-                'new_visitors': new_visitors,
-                'returning_visitors': returning_visitors,
-            }
+            page_views=page_views,
+            unique_page_views=unique_page_views,
+            sessions=sessions_count,
+            avg_session_duration=avg_duration,
+            bounce_rate=bounce_rate,
+            unique_visitors=unique_visitors,
+            new_visitors=new_visitors,
+            returning_visitors=returning_visitors,
         )
-        
-        if not created:
-            daily_stats.page_views = page_views
-            daily_stats.unique_page_views = unique_page_views
-            daily_stats.sessions = sessions_count
-            daily_stats.avg_session_duration = avg_duration
-            daily_stats.bounce_rate = bounce_rate
-            daily_stats.unique_visitors = unique_visitors
-            daily_stats.new_visitors = new_visitors
-            daily_stats.returning_visitors = returning_visitors
-            daily_stats.save()
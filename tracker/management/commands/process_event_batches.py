@@ -8,7 +8,7 @@ class Command(BaseCommand):
         parser.add_argument(
             '--continuous',
             action='store_true',
-            help='Run continuously, processing batches every few seconds',
+            help='Run continuously, processing batches as events arrive',
         )
     
     def handle(self, *args, **options):
@@ -19,8 +19,9 @@ class Command(BaseCommand):
             self.stdout.write("Starting continuous batch processing...")
             while True:
                 try:
-                    processor.process_batch()
-                    time.sleep(5)  # Process every 5 seconds
+                    # Blocks on BRPOP, so events are picked up as soon as they
+                    # arrive and an idle queue costs one round-trip per 5 seconds
+                    processor.wait_and_process_batch(timeout=5)
                 except KeyboardInterrupt:
                     self.stdout.write("Stopping batch processor...")
                     break
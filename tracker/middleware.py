@@ -1,5 +1,5 @@
 from django.utils import timezone
-from .models import Session
+from .batch_processor import event_processor
 import logging
 
 logger = logging.getLogger(__name__)
@@ -9,30 +9,25 @@ class EventProcessingMiddleware:
     
     def __init__(self, get_response):
         self.get_response = get_response
+        self.processor = event_processor
     
     def __call__(self, request):
         response = self.get_response(request)
         
         # Process any pending session updates
-        if hasattr(request, '_analytics_session_id'):
+        if hasattr(request, '_analytics_session_id') and hasattr(request, '_analytics_website_id'):
             try:
-                self.update_session_duration(request._analytics_session_id)
+                self.update_session_duration(request._analytics_website_id, request._analytics_session_id)
             except Exception as e:
                 logger.error(f"Error updating session duration: {e}")
         
         return response
     
-    def update_session_duration(self, session_id):
-        """Update session duration and end time"""
-        try:
-            session = Session.objects.get(session_id=session_id)
-            now = timezone.now()
-            session.ended_at = now
-            
-            if session.started_at:
-                duration = (now - session.started_at).total_seconds()
-                session.duration_seconds = int(duration)
-            
-            session.save()
-        except Session.DoesNotExist:
-            pass
\ No newline at end of file
+    def update_session_duration(self, website_id, session_id):
+        """Queue a session end; the batch processor updates duration and end time"""
+        self.processor.queue_event({
+            'event_type': 'session_end',
+            'website_id': str(website_id),
+            'session_id': session_id,
+            'ended_at': timezone.now().isoformat(),
+        })
\ No newline at end of file
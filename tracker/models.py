@@ -2,6 +2,7 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.conf import settings
+from fast_update.query import FastUpdateManager
 import uuid
 
 class Website(models.Model):
@@ -27,6 +28,9 @@ class Visitor(models.Model):
     started_at = models.DateTimeField(default=timezone.now,db_index=True) 
     device_type = models.CharField(max_length=50, null=True, blank=True)
     country = models.CharField(max_length=100, null=True, blank=True)
+
+    objects = FastUpdateManager()
+
     class Meta:
         unique_together = ['website', 'visitor_id']
         indexes = [
@@ -61,8 +65,23 @@ class Session(models.Model):
     city = models.CharField(max_length=100, null=True, blank=True)
     location = models.CharField(max_length=255, null=True, blank=True)  
     
+    objects = FastUpdateManager()
+    
     class Meta:
         unique_together = ['website', 'session_id']
+        indexes = [
+            # Covers the device, browser and geography breakdowns and the daily
+            # trend with index-only scans. page_views and duration_seconds change
+            # after insert, so they stay out to keep those updates HOT.
+            models.Index(
+                fields=['website', 'started_at'],
+                include=[
+                    'visitor', 'device_type', 'os_name', 'browser_name', 'browser_version',
+                    'country', 'region', 'city',
+                ],
+                name='sess_web_time_incl'
+            ),
+        ]
 
 class PageView(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -98,7 +117,8 @@ class PageView(models.Model):
     viewport_height = models.IntegerField(null=True, blank=True)
     class Meta:
         indexes = [
-            models.Index(fields=['website', 'timestamp']),
+            # Covers the traffic source breakdown with index-only scans
+            models.Index(fields=['website', 'timestamp'], include=['traffic_source'], name='pv_web_time_incl'),
             models.Index(fields=['visitor_id', 'timestamp']), 
             models.Index(fields=['session', 'timestamp']),
             models.Index(fields=['page_path', 'timestamp']),
@@ -121,6 +141,16 @@ class CustomEvent(models.Model):
     properties = models.JSONField(default=dict, blank=True)
     
     timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    class Meta:
+        indexes = [
+            # Covers the popular events breakdown with index-only scans
+            models.Index(
+                fields=['website', 'timestamp'],
+                include=['event_name', 'event_category'],
+                name='event_web_time_incl'
+            ),
+        ]
 
 # Analytics aggregation models
 class DailyStats(models.Model):
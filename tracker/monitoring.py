@@ -1,17 +1,24 @@
-import requests
-import time
+from collections import namedtuple
+import orjson
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from django.core.management.base import BaseCommand
 from django.core.cache import cache
-from django.db.models import Count, Avg
-from tracker.models import Website, PageView, Session
-from django.core.mail import send_mail
+from django.db.models import Count, Q, Sum
+from tracker.models import Website, PageView, DailyStats
+from django.core.mail import EmailMessage, get_connection
 from django.conf import settings
 from django.utils import timezone
+from tracker.utils import build_http_session
 import logging
 
 logger = logging.getLogger(__name__)
 
+# The few columns monitoring reads, instead of full Website and User instances
+MonitoredSite = namedtuple('MonitoredSite', ['id', 'name', 'domain', 'owner_email'])
+
+# Pooled keep-alive connections for health checks; sized for the worker pool
+HEALTH_SESSION = build_http_session(pool_size=64)
+
 class WebsiteMonitor:
     """
     Monitor websites for analytics collection and health
@@ -23,52 +30,156 @@ class WebsiteMonitor:
             'traffic_drop_percent': 50,  # Alert if traffic drops by 50%
             'error_rate_percent': 10,  # Alert if error rate > 10%
         }
+        self.health_check_workers = 50  # Concurrent health checks
+        self.cache_timeout = 300  # Monitoring tolerates 5 minutes of staleness
+        self.pending_alerts = None  # Collected during a monitoring run
     
-    def monitor_all_websites(self):
-        """Monitor all active websites"""
-        websites = Website.objects.filter(is_active=True).select_related('owner')
-        
-        for website in websites:
-            try:
-                self.check_website_health(website)
-                self.check_analytics_flow(website)
-                self.check_traffic_anomalies(website)
-            except Exception as e:
-                logger.error(f"Monitoring failed for website {website.id}: {e}")
+    def monitor_all_websites(self, website_ids=None):
+        """Monitor all active websites, or only the given subset of them"""
+        websites = self.get_active_websites()
+        if website_ids is not None:
+            wanted = {str(website_id) for website_id in website_ids}
+            websites = [website for website in websites if str(website.id) in wanted]
+        
+        # Health checks are pure network wait, so overlap them
+        self.check_websites_health(websites)
+        
+        # One grouped query covers the traffic counts for every website
+        traffic_counts = self.get_traffic_counts(websites)
+        
+        # Alerts raised below are collected and sent over one connection
+        self.pending_alerts = []
+        try:
+            for website in websites:
+                try:
+                    counts = traffic_counts.get(website.id, {})
+                    self.check_analytics_flow(website, counts.get('recent', 0))
+                    self.check_traffic_anomalies(website, counts.get('today', 0), counts.get('weekly', 0))
+                except Exception as e:
+                    logger.error(f"Monitoring failed for website {website.id}: {e}")
+        finally:
+            alerts, self.pending_alerts = self.pending_alerts, None
+            self.send_alerts(alerts)
+    
+    def get_active_websites(self):
+        """Active websites with their owners, cached for a few minutes"""
+        websites = cache.get('monitor:active_sites')
+        if websites is None:
+            websites = [
+                MonitoredSite(*row) for row in
+                Website.objects.filter(is_active=True).values_list('id', 'name', 'domain', 'owner__email')
+            ]
+            cache.set('monitor:active_sites', websites, self.cache_timeout)
+        return websites
+    
+    def check_websites_health(self, websites):
+        """Check many websites concurrently and cache all results at once"""
+        if not websites:
+            return {}
+        
+        workers = min(self.health_check_workers, len(websites))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(self.probe_website, websites))
+        
+        # Cache health status; pre-encoded JSON bytes are cheaper to store than pickled dicts
+        cache.set_many({
+            f"website_health:{website.id}": orjson.dumps(health)
+            for website, health in zip(websites, results)
+        }, timeout=600)
+        
+        return {website.id: health['healthy'] for website, health in zip(websites, results)}
     
     def check_website_health(self, website):
         """Check if website is accessible"""
+        health = self.probe_website(website)
+        
+        # Cache health status
+        cache.set(f"website_health:{website.id}", orjson.dumps(health), timeout=600)
+        
+        return health['healthy']
+    
+    def get_website_health(self, website_id):
+        """Read the last cached health check for a website"""
+        payload = cache.get(f"website_health:{website_id}")
+        return orjson.loads(payload) if payload is not None else None
+    
+    def probe_website(self, website):
+        """Request the website and describe its health"""
         try:
-            response = requests.get(website.domain, timeout=10)
-            is_healthy = response.status_code == 200
-            
-            # Cache health status
-            cache.set(f"website_health:{website.id}", {
-                'healthy': is_healthy,
+            # Only the status line matters, so skip downloading the body
+            response = HEALTH_SESSION.head(website.domain, timeout=10, allow_redirects=True)
+            if response.status_code in (405, 501):
+                # Origin rejects HEAD; stream a GET and close before reading
+                response = HEALTH_SESSION.get(website.domain, timeout=10, stream=True)
+                response.close()
+            return {
+                'healthy': response.status_code == 200,
                 'status_code': response.status_code,
                 'response_time': response.elapsed.total_seconds(),
                 'checked_at': datetime.now().isoformat()
-            }, timeout=600)
-            
-            return is_healthy
+            }
         except Exception as e:
+            # Anything from a malformed domain to a network error marks the site
+            # down, so one bad website can't abort the whole monitoring run
             logger.warning(f"Health check failed for {website.domain}: {e}")
-            cache.set(f"website_health:{website.id}", {
+            return {
                 'healthy': False,
                 'error': str(e),
                 'checked_at': datetime.now().isoformat()
-            }, timeout=600)
-            return False
+            }
     
-    def check_analytics_flow(self, website):
-        """Check if analytics data is flowing"""
+    def get_traffic_counts(self, websites):
+        """
+        Count page views per website for the monitoring windows:
+        'recent' (no-data window) and 'today' from live page views in one
+        grouped query, 'weekly' (the seven days before today) from the
+        DailyStats rollup instead of re-scanning PageView
+        """
         now = timezone.now()
-        cutoff = now - timedelta(hours=self.alert_thresholds['no_data_hours'])
+        today_start = timezone.localtime(now).replace(hour=0, minute=0, second=0, microsecond=0)
+        today = today_start.date()
+        yesterday = today - timedelta(days=1)
+        week_ago = today - timedelta(days=7)
+        recent_cutoff = now - timedelta(hours=self.alert_thresholds['no_data_hours'])
+        
+        counts = {website.id: {'recent': 0, 'today': 0, 'weekly': 0} for website in websites}
+        
+        live_rows = PageView.objects.filter(
+            website_id__in=[website.id for website in websites],
+            timestamp__gte=min(recent_cutoff, today_start)
+        ).values('website_id').annotate(
+            recent=Count('id', filter=Q(timestamp__gte=recent_cutoff)),
+            today=Count('id', filter=Q(timestamp__gte=today_start))
+        ).order_by()
+        for row in live_rows:
+            counts[row['website_id']].update(recent=row['recent'], today=row['today'])
+        
+        # The weekly baseline only changes when the rollup runs, so cache it
+        weekly_keys = {f"monitor:weekly:{website.id}:{yesterday}": website.id for website in websites}
+        cached_weekly = cache.get_many(list(weekly_keys))
+        for key, weekly in cached_weekly.items():
+            counts[weekly_keys[key]]['weekly'] = weekly
+        
+        missing_ids = [website_id for key, website_id in weekly_keys.items() if key not in cached_weekly]
+        if missing_ids:
+            rollup_rows = DailyStats.objects.filter(
+                website_id__in=missing_ids,
+                date__range=[week_ago, yesterday]
+            ).values('website_id').annotate(weekly=Sum('page_views')).order_by()
+            for row in rollup_rows:
+                counts[row['website_id']]['weekly'] = row['weekly']
+            
+            cache.set_many({
+                key: counts[website_id]['weekly']
+                for key, website_id in weekly_keys.items() if key not in cached_weekly
+            }, self.cache_timeout)
         
-        recent_events = PageView.objects.filter(
-            website=website,
-            timestamp__gte=cutoff
-        ).count()
+        return counts
+    
+    def check_analytics_flow(self, website, recent_events=None):
+        """Check if analytics data is flowing"""
+        if recent_events is None:
+            recent_events = self.get_traffic_counts([website]).get(website.id, {}).get('recent', 0)
         
         if recent_events == 0:
             self.send_alert(
@@ -79,24 +190,15 @@ class WebsiteMonitor:
         
         return recent_events > 0
     
-    def check_traffic_anomalies(self, website):
+    def check_traffic_anomalies(self, website, today_traffic=None, weekly_traffic=None):
         """Check for traffic anomalies"""
-        now = timezone.now()
-        today = now.date()
-        yesterday = today - timedelta(days=1)
-        week_ago = today - timedelta(days=7)
-        
-        # Get today's traffic
-        today_traffic = PageView.objects.filter(
-            website=website,
-            timestamp__date=today
-        ).count()
+        if today_traffic is None or weekly_traffic is None:
+            counts = self.get_traffic_counts([website]).get(website.id, {})
+            today_traffic = counts.get('today', 0)
+            weekly_traffic = counts.get('weekly', 0)
         
-        # Get average traffic for the past week
-        avg_weekly_traffic = PageView.objects.filter(
-            website=website,
-            timestamp__date__range=[week_ago, yesterday]
-        ).count() / 7
+        # Average traffic for the past week
+        avg_weekly_traffic = weekly_traffic / 7
         
         if avg_weekly_traffic > 0:
             drop_percent = ((avg_weekly_traffic - today_traffic) / avg_weekly_traffic) * 100
@@ -109,15 +211,27 @@ class WebsiteMonitor:
                 )
     
     def send_alert(self, website, subject, message):
-        """Send alert to website owner"""
+        """Send alert to website owner, or queue it during a monitoring run"""
+        email = EmailMessage(
+            subject=f"[Analytics Alert] {subject} - {website.name}",
+            body=f"Website: {website.name} ({website.domain})\n\n{message}",
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[website.owner_email]
+        )
+        if self.pending_alerts is not None:
+            self.pending_alerts.append(email)
+        else:
+            self.send_alerts([email])
+    
+    def send_alerts(self, emails):
+        """Send alert emails over a single mail connection"""
+        if not emails:
+            return 0
         try:
-            send_mail(
-                subject=f"[Analytics Alert] {subject} - {website.name}",
-                message=f"Website: {website.name} ({website.domain})\n\n{message}",
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[website.owner.email],
-                fail_silently=False
-            )
-            logger.info(f"Alert sent to {website.owner.email}: {subject}")
+            with get_connection(fail_silently=False) as connection:
+                sent = connection.send_messages(emails)
+            logger.info(f"Sent {sent} alert(s)")
+            return sent
         except Exception as e:
-            logger.error(f"Failed to send alert: {e}")
+            logger.error(f"Failed to send alerts: {e}")
+            return 0
@@ -0,0 +1,16 @@
+import orjson
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSON renderer backed by orjson. Dates, datetimes and UUIDs are encoded
+    natively; anything else (lazy strings, Decimals, querysets) falls back
+    to DRF's own encoder rules
+    """
+    encoder = JSONEncoder()
+    
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return orjson.dumps(data, default=self.encoder.default, option=orjson.OPT_NON_STR_KEYS)
@@ -1,3 +1,8 @@
+import ipaddress
+from datetime import datetime
+from typing import Annotated, Literal, Optional
+from uuid import UUID
+import msgspec
 from rest_framework import serializers
 from .models import Website, PageView, Session, CustomEvent, DailyStats
 
@@ -62,6 +67,94 @@ class EventIngestionSerializer(serializers.Serializer):
     event_label = serializers.CharField(max_length=255, required=False, allow_blank=True)
     event_value = serializers.FloatField(required=False, allow_null=True)
     properties = serializers.JSONField(required=False, default=dict)
+
+
+Short = Annotated[str, msgspec.Meta(max_length=50)]
+Medium = Annotated[str, msgspec.Meta(max_length=100)]
+Long = Annotated[str, msgspec.Meta(max_length=255)]
+Id = Annotated[str, msgspec.Meta(min_length=1, max_length=255)]
+
+# Column length of the URLFields; longer URLs are truncated, not rejected
+URL_MAX_LENGTH = 200
+
+class IngestEvent(msgspec.Struct, kw_only=True):
+    """
+    Compiled validator for the ingest hot path; mirrors EventIngestionSerializer,
+    which is kept for the browsable API and schema generation
+    """
+    tracking_id: UUID
+    visitor_id: Id
+    session_id: Id
+    
+    # Event data
+    event_type: Literal[
+        'pageview', 'custom', 'click', 'form_submit',
+        'scroll_depth', 'heartbeat', 'identify', 'performance'
+    ]
+    timestamp: datetime
+    
+    # Page view specific
+    page_url: str = ''
+    page_title: Long = ''
+    page_path: Annotated[str, msgspec.Meta(max_length=500)] = ''
+    referrer_url: str = ''
+    referrer_domain: Long = ''
+    traffic_source: Medium = ''
+    
+    # UTM parameters
+    utm_source: Long = ''
+    utm_medium: Long = ''
+    utm_campaign: Long = ''
+    utm_term: Long = ''
+    utm_content: Long = ''
+    
+    # Device info
+    user_agent: str = ''
+    device_type: Short = ''
+    browser_name: Medium = ''
+    browser_version: Short = ''
+    os_name: Medium = ''
+    os_version: Short = ''
+    timezone: Short = ''
+    
+    # Screen info
+    screen_width: Optional[int] = None
+    screen_height: Optional[int] = None
+    viewport_width: Optional[int] = None
+    viewport_height: Optional[int] = None
+    
+    # Location info
+    ip_address: str = ''
+    country: Medium = ''
+    region: Medium = ''
+    city: Medium = ''
+    
+    # Custom event specific
+    event_name: Long = ''
+    event_category: Medium = ''
+    event_action: Medium = ''
+    event_label: Long = ''
+    event_value: Optional[float] = None
+    properties: dict = {}
+
+ingest_event_decoder = msgspec.json.Decoder(IngestEvent)
+
+def decode_ingest_event(body):
+    """Validate a raw JSON request body and return the event as a dict"""
+    event = msgspec.structs.asdict(ingest_event_decoder.decode(body))
+    
+    # Tracking parameters easily push URLs past the column; keep the pageview
+    event['page_url'] = event['page_url'][:URL_MAX_LENGTH]
+    event['referrer_url'] = event['referrer_url'][:URL_MAX_LENGTH]
+    
+    # Malformed addresses would only fail later on the GenericIPAddressField
+    try:
+        if event['ip_address']:
+            event['ip_address'] = str(ipaddress.ip_address(event['ip_address']))
+    except ValueError:
+        event['ip_address'] = ''
+    return event
+
 class PageViewAnalyticsSerializer(serializers.Serializer):
     date = serializers.DateField()
     page_views = serializers.IntegerField()
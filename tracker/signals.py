@@ -0,0 +1,9 @@
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Website
+
+@receiver([post_save, post_delete], sender=Website)
+def clear_website_lookup(sender, instance, **kwargs):
+    """Drop the cached tracking ID lookup so ingestion sees the change"""
+    cache.delete(f"website:{instance.tracking_id}")
@@ -1,54 +1,103 @@
-from celery import shared_task
+from celery import group, shared_task
 from django.core.management import call_command
-from .models import Session
+from .models import Session, Website
+from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
 from datetime import timedelta
-from .batch_processor import BatchEventProcessor
+from .batch_processor import event_processor
 from .monitoring import WebsiteMonitor
 @shared_task
-def aggregate_daily_stats():
-    """Background task to aggregate daily statistics"""
-    call_command('aggregate_daily_stats')
+def aggregate_daily_stats(date=None):
+    """Background task to aggregate daily statistics (yesterday by default)"""
+    call_command('aggregate_daily_stats', date=date)
+
+@shared_task
+def aggregate_today_stats():
+    """Refresh today's running DailyStats row so dashboards can read the rollup"""
+    call_command('aggregate_daily_stats', date=timezone.localdate().isoformat())
 
 @shared_task
 def cleanup_old_sessions():
     """Cleanup sessions that haven't been updated in a while"""
     cutoff_time = timezone.now() - timedelta(minutes=30)
     
-    old_sessions = Session.objects.filter(
+    Session.objects.filter(
         ended_at__isnull=True,
         started_at__lt=cutoff_time
+    ).update(
+        ended_at=F('started_at') + timedelta(minutes=30),
+        duration_seconds=1800  # 30 minutes
     )
-    
-    for session in old_sessions:
-        session.ended_at = session.started_at + timedelta(minutes=30)
-        session.duration_seconds = 1800  # 30 minutes
-        session.save()
 @shared_task
 def process_event_batches():
     """Process queued analytics events"""
-    processor = BatchEventProcessor()
-    return processor.process_batch()
+    return event_processor.process_batch()
+
+@shared_task
+def monitor_websites(shard_size=100):
+    """Fan website monitoring out across workers in shards"""
+    website_ids = [
+        str(website_id) for website_id in
+        Website.objects.filter(is_active=True).values_list('id', flat=True)
+    ]
+    shards = [website_ids[i:i + shard_size] for i in range(0, len(website_ids), shard_size)]
+    group(monitor_website_shard.s(shard) for shard in shards).apply_async()
+    return f"Dispatched monitoring of {len(website_ids)} websites in {len(shards)} shards"
 
 @shared_task
-def monitor_websites():
-    """Monitor all websites"""
+def monitor_website_shard(website_ids):
+    """Monitor one shard of websites"""
     monitor = WebsiteMonitor()
-    monitor.monitor_all_websites()
-    return "Website monitoring completed"
+    monitor.monitor_all_websites(website_ids)
+    return f"Monitored {len(website_ids)} websites"
 
 @shared_task
 def cleanup_old_data():
     """Cleanup old analytics data"""
-    from django.utils import timezone
-    from datetime import timedelta
     from .models import PageView, CustomEvent, Session
     
     # Delete data older than 2 years
     cutoff_date = timezone.now() - timedelta(days=730)
     
-    deleted_pageviews = PageView.objects.filter(timestamp__lt=cutoff_date).delete()[0]
-    deleted_events = CustomEvent.objects.filter(timestamp__lt=cutoff_date).delete()[0]
-    deleted_sessions = Session.objects.filter(started_at__lt=cutoff_date).delete()[0]
+    deleted_pageviews = delete_in_chunks(PageView.objects.filter(timestamp__lt=cutoff_date))
+    deleted_events = delete_in_chunks(CustomEvent.objects.filter(timestamp__lt=cutoff_date))
+    
+    # Sessions still own page views and events recorded after the cutoff,
+    # so clear those children first within the same chunk
+    deleted_sessions = delete_in_chunks(
+        Session.objects.filter(started_at__lt=cutoff_date),
+        dependents=[(PageView, 'session'), (CustomEvent, 'session')]
+    )
     
     return f"Deleted {deleted_pageviews} pageviews, {deleted_events} events, {deleted_sessions} sessions"
+
+def delete_in_chunks(queryset, dependents=(), chunk_size=10000):
+    """
+    Delete matching rows a chunk of primary keys at a time, each chunk in its
+    own short transaction, skipping the ORM's collector and signals
+    """
+    model = queryset.model
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            # Any chunk will do, so no ORDER BY: sorting the random UUID keys
+            # would re-sort every matching row for each chunk
+            pks = list(queryset.order_by().values_list('pk', flat=True)[:chunk_size])
+            if not pks:
+                return deleted
+            for dependent, field in dependents:
+                raw_delete(dependent.objects.filter(**{f'{field}__in': pks}))
+            deleted += raw_delete(model.objects.filter(pk__in=pks))
+
+def raw_delete(queryset):
+    """
+    Issue a single DELETE for the queryset, bypassing the collector that
+    would load every row to cascade and send signals. That is only safe for
+    the analytics tables cleaned up here: no delete signals are connected to
+    them, and the only rows referencing a Session (its page views and
+    events) are passed to delete_in_chunks as dependents and deleted first.
+    Returns the number of rows deleted.
+    """
+    # QuerySet._raw_delete is private Django API; keep its use to this helper
+    return queryset._raw_delete(queryset.db)
@@ -1,3 +1,130 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from unittest import mock
+from django.db import OperationalError
+from django.test import SimpleTestCase, TestCase, override_settings
+from .batch_processor import decode_event, encode_event, event_processor
+from .models import Website, Visitor, Session, PageView, CustomEvent
+from .utils import get_traffic_source
 
-# Create your tests here.
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class BatchProcessingTests(TestCase):
+    def setUp(self):
+        owner = get_user_model().objects.create_user(
+            username='owner', email='owner@example.com', password='password'
+        )
+        self.website = Website.objects.create(owner=owner, name='Example', domain='https://example.com')
+    
+    def make_event(self, **fields):
+        event = {
+            'tracking_id': str(self.website.tracking_id),
+            'website_id': str(self.website.id),
+            'visitor_id': 'visitor-1',
+            'session_id': 'session-1',
+            'event_type': 'pageview',
+            'page_url': 'https://example.com/pricing?plan=pro',
+            'page_title': 'Pricing',
+            'user_agent': 'Mozilla/5.0',
+            'client_ip': '127.0.0.1',
+            'timestamp': '2025-01-01T12:00:00Z',
+        }
+        event.update(fields)
+        return encode_event(event)
+    
+    def test_batch_is_stored(self):
+        raw_events = [
+            self.make_event(),
+            self.make_event(page_url='https://example.com/'),
+            self.make_event(event_type='custom', event_name='signup'),
+        ]
+        
+        self.assertTrue(event_processor.process_raw_events(raw_events))
+        
+        self.assertEqual(Visitor.objects.filter(website=self.website).count(), 1)
+        session = Session.objects.get(website=self.website, session_id='session-1')
+        self.assertEqual(session.page_views, 2)
+        self.assertEqual(
+            sorted(PageView.objects.filter(session=session).values_list('page_path', flat=True)),
+            ['https://example.com/', 'https://example.com/pricing']
+        )
+        self.assertEqual(CustomEvent.objects.get(session=session).event_name, 'signup')
+    
+    def test_second_batch_reuses_stored_session(self):
+        event_processor.process_raw_events([self.make_event()])
+        event_processor.process_raw_events([self.make_event(page_url='https://example.com/docs')])
+        
+        self.assertEqual(Session.objects.filter(website=self.website).count(), 1)
+        self.assertEqual(PageView.objects.filter(website=self.website).count(), 2)
+        self.assertTrue(Visitor.objects.get(website=self.website).is_returning)
+    
+    def test_failing_event_is_isolated_and_requeued(self):
+        raw_events = [self.make_event(), self.make_event(session_id='session-2', timestamp='not-a-date')]
+        
+        with mock.patch.object(event_processor, 'redis_client') as redis_client:
+            self.assertFalse(event_processor.process_raw_events(raw_events))
+        
+        self.assertEqual(PageView.objects.filter(website=self.website).count(), 1)
+        key, requeued = redis_client.lpush.call_args.args
+        self.assertEqual(key, event_processor.event_queue_key)
+        self.assertEqual(decode_event(requeued)['session_id'], 'session-2')
+        self.assertEqual(decode_event(requeued)['attempts'], 1)
+    
+    def test_event_is_dead_lettered_after_max_retries(self):
+        raw_event = self.make_event(timestamp='not-a-date', attempts=event_processor.max_event_retries - 1)
+        
+        with mock.patch.object(event_processor, 'redis_client') as redis_client:
+            event_processor.process_raw_events([raw_event])
+        
+        redis_client.lpush.assert_called_once_with(event_processor.dead_letter_key, raw_event)
+    
+    def test_outage_requeues_batch_unchanged(self):
+        raw_events = [self.make_event(), self.make_event(session_id='session-2')]
+        self.addCleanup(setattr, event_processor, 'resume_at', 0.0)
+        self.addCleanup(setattr, event_processor, 'failed_batches', 0)
+        
+        with mock.patch.object(event_processor, 'redis_client') as redis_client, \
+                mock.patch.object(event_processor, 'process_website_batch', side_effect=OperationalError):
+            self.assertFalse(event_processor.process_raw_events(raw_events))
+            # Backing off: the next beat leaves the queue alone
+            self.assertFalse(event_processor.process_batch())
+        
+        redis_client.rpush.assert_called_once_with(event_processor.event_queue_key, *reversed(raw_events))
+        redis_client.lpush.assert_not_called()
+        redis_client.rpop.assert_not_called()
+    
+    def test_session_end_only_touches_its_website(self):
+        other = Website.objects.create(owner=self.website.owner, name='Other', domain='https://other.example.com')
+        event_processor.process_raw_events([
+            self.make_event(),
+            self.make_event(tracking_id=str(other.tracking_id), website_id=str(other.id)),
+        ])
+        
+        event_processor.process_raw_events([encode_event({
+            'event_type': 'session_end',
+            'website_id': str(self.website.id),
+            'session_id': 'session-1',
+            'ended_at': '2025-01-01T12:10:00+00:00',
+        })])
+        
+        self.assertIsNotNone(Session.objects.get(website=self.website).ended_at)
+        self.assertIsNone(Session.objects.get(website=other).ended_at)
+
+class TrafficSourceTests(SimpleTestCase):
+    def test_country_domains_and_trailing_dots(self):
+        for referrer in [
+            'https://www.google.com.au/search?q=visiora',
+            'https://google.com.br/',
+            'https://search.yahoo.com.tw/search',
+            'https://www.google.co.uk/',
+            'https://www.google.de/',
+            'https://www.google.com./',
+        ]:
+            with self.subTest(referrer=referrer):
+                self.assertEqual(get_traffic_source(referrer, '', ''), 'organic')
+        
+        self.assertEqual(get_traffic_source('https://m.facebook.com/', '', ''), 'social')
+        self.assertEqual(get_traffic_source('https://es.reddit.com./r/django', '', ''), 'social')
+    
+    def test_lookalike_domains_are_referrals(self):
+        self.assertEqual(get_traffic_source('https://notgoogle.com/', '', ''), 'referral')
+        self.assertEqual(get_traffic_source('https://google.example.com.au/', '', ''), 'referral')
+        self.assertEqual(get_traffic_source('https://example.com/', '', ''), 'referral')
@@ -0,0 +1,38 @@
+import logging
+import time
+from django.conf import settings
+from redis.exceptions import RedisError
+from rest_framework.throttling import BaseThrottle
+from .batch_processor import event_processor
+
+logger = logging.getLogger(__name__)
+
+class IngestRateThrottle(BaseThrottle):
+    """
+    Fixed one-minute window per client address (REMOTE_ADDR unless
+    NUM_PROXIES trusts X-Forwarded-For hops), counted with a pipelined
+    INCR/EXPIRE on Redis before the request body is read
+    """
+    window_seconds = 60
+    
+    def allow_request(self, request, view):
+        limit = settings.TRACKER_SETTINGS['INGEST_RATE_LIMIT']
+        now = time.time()
+        window = int(now // self.window_seconds)
+        key = f"ingest_rate:{self.get_ident(request)}:{window}"
+        
+        try:
+            pipe = event_processor.redis_client.pipeline(transaction=False)
+            pipe.incr(key)
+            pipe.expire(key, self.window_seconds)
+            count, _ = pipe.execute()
+        except RedisError as e:
+            # Never drop events because the limiter itself is unavailable
+            logger.warning(f"Ingest rate limiter unavailable: {e}")
+            return True
+        
+        self.wait_seconds = self.window_seconds - now % self.window_seconds
+        return count <= limit
+    
+    def wait(self):
+        return self.wait_seconds
@@ -9,7 +9,7 @@ urlpatterns = [
     path('', include(router.urls)),
     
     # Event ingestion
-    path('ingest/', views.ingest_event, name='ingest_event'),
+    path('ingest/', views.ingest_event_optimized, name='ingest_event'),
     path('debug-ingest/', views.debug_ingest, name='debug_ingest'),
     path('dashboard/<uuid:website_id>/', views.website_detail_dashboard, name='website_dashboard'),
     # Analytics endpoints
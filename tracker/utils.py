@@ -1,19 +1,96 @@
 from user_agents import parse
+from datetime import date, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from functools import lru_cache
+import ipaddress
+import logging
+import re
 import requests
+from requests.adapters import HTTPAdapter
 from urllib.parse import urlparse
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Referrer domains used to classify traffic sources. Matched against the
+# referrer host and each of its parent domains, so subdomains such as
+# m.facebook.com or news.google.com are covered by a hash lookup.
+SOCIAL_DOMAINS = frozenset({
+    'facebook.com', 'twitter.com', 'linkedin.com', 'instagram.com',
+    'youtube.com', 'tiktok.com', 'pinterest.com', 'reddit.com'
+})
+SEARCH_DOMAINS = frozenset({
+    'google.com', 'bing.com', 'yahoo.com', 'duckduckgo.com',
+    'baidu.com', 'yandex.com'
+})
+
+# Host of an http(s) URL, skipping any userinfo; stops at port, path, query or fragment
+REFERRER_HOST_RE = re.compile(r'^https?://(?:[^@/?#]*@)?([^/:?#@\[\]]+)', re.IGNORECASE)
+
+# Country-code suffix of a host (.de, .co.uk, .com.au): search and social
+# sites share a registrable label across ccTLDs, so hosts are also matched
+# with this suffix swapped for .com
+COUNTRY_SUFFIX_RE = re.compile(r'\.(?:com?\.)?[a-z]{2}$')
+
+# Network location (authority) of a URL, as urlparse(url).netloc would return it
+URL_NETLOC_RE = re.compile(r'^(?:[a-zA-Z][a-zA-Z0-9+.-]*:)?//([^/?#]*)')
+
+def build_http_session(pool_size=64, retries=0):
+    """
+    Build a requests.Session that keeps connections alive and reuses them
+    across calls, instead of paying a TCP/TLS handshake per request
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=Retry(total=retries, connect=retries, read=0, backoff_factor=0.1),
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['Connection'] = 'keep-alive'
+    return session
+
+# Shared by outbound lookups such as IP geolocation
+HTTP_SESSION = build_http_session(retries=2)
+
+# ip-api.com accepts up to 100 addresses per batch request
+IP_API_BATCH_URL = 'http://ip-api.com/batch'
+IP_API_BATCH_SIZE = 100
+GEOIP_CACHE_TIMEOUT = 60 * 60 * 24  # 24 hours
 
 def parse_user_agent(user_agent_string):
     """Parse user agent string to extract device/browser info"""
-    user_agent = parse(user_agent_string)
+    device_type, browser_name, browser_version, os_name, os_version = (
+        cached_user_agent_fields(user_agent_string or '')
+    )
     
     return {
-        'device_type': get_device_type(user_agent),
-        'browser_name': user_agent.browser.family,
-        'browser_version': user_agent.browser.version_string,
-        'os_name': user_agent.os.family,
-        'os_version': user_agent.os.version_string,
+        'device_type': device_type,
+        'browser_name': browser_name,
+        'browser_version': browser_version,
+        'os_name': os_name,
+        'os_version': os_version,
     }
 
+@lru_cache(maxsize=16384)
+def cached_user_agent_fields(user_agent_string):
+    """
+    Regex-heavy UA parsing, memoized per process. A small set of UA strings
+    covers most traffic, so nearly every call is a cache hit.
+    """
+    user_agent = parse(user_agent_string)
+    
+    return (
+        get_device_type(user_agent),
+        user_agent.browser.family,
+        user_agent.browser.version_string,
+        user_agent.os.family,
+        user_agent.os.version_string,
+    )
+
 def get_device_type(user_agent):
     """Determine device type from user agent"""
     if user_agent.is_mobile:
@@ -33,52 +110,52 @@ def get_traffic_source(referrer_url, utm_source, utm_medium):
     if not referrer_url:
         return 'direct'
     
-    try:
-        domain = urlparse(referrer_url).netloc.lower()
-        
-        # Social media sources
-        social_domains = [
-            'facebook.com', 'twitter.com', 'linkedin.com', 'instagram.com',
-            'youtube.com', 'tiktok.com', 'pinterest.com', 'reddit.com'
-        ]
-        for social in social_domains:
-            if social in domain:
+    match = REFERRER_HOST_RE.match(referrer_url)
+    if match:
+        domain = match.group(1).lower()
+    else:
+        # Unusual URLs (IPv6 hosts, other schemes) take the full parse
+        try:
+            domain = urlparse(referrer_url).hostname or ''
+        except ValueError:
+            return 'unknown'
+    
+    # Fully qualified hosts may end in a dot (www.google.com.)
+    domain = domain.rstrip('.')
+    
+    for host in (domain, COUNTRY_SUFFIX_RE.sub('.com', domain)):
+        labels = host.split('.')
+        for i in range(len(labels) - 1):
+            parent = '.'.join(labels[i:])
+            
+            # Social media sources
+            if parent in SOCIAL_DOMAINS:
                 return 'social'
-        
-        # Search engines
-        search_domains = [
-            'google.com', 'bing.com', 'yahoo.com', 'duckduckgo.com',
-            'baidu.com', 'yandex.com'
-        ]
-        for search in search_domains:
-            if search in domain:
+            
+            # Search engines
+            if parent in SEARCH_DOMAINS:
                 return 'organic'
-        
-        return 'referral'
-    except:
-        return 'unknown'
-
-def get_location_from_ip(ip_address):
-    """Get location information from IP address"""
-    # This is a basic implementation. In production, use a proper IP geolocation service
-    # like MaxMind GeoIP2, IPStack, or similar
-    try:
-        # Using a free service for demo (replace with paid service in production)
-        response = requests.get(f'http://ip-api.com/json/{ip_address}', timeout=2)
-        if response.status_code == 200:
-            data = response.json()
-            if data['status'] == 'success':
-                return {
-                    'country': data.get('country'),
-                    'region': data.get('regionName'),
-                    'city': data.get('city'),
-                    'latitude': data.get('lat'),
-                    'longitude': data.get('lon'),
-                }
-    except:
-        pass
     
-    return {}
+    return 'referral'
+
+def get_date_range(request, default_days=30):
+    """
+    Read the start_date/end_date query parameters (YYYY-MM-DD), defaulting
+    to the last default_days days when either is missing
+    """
+    start_date = request.GET.get('start_date')
+    end_date = request.GET.get('end_date')
+    if not start_date or not end_date:
+        end_date = timezone.now().date()
+        return end_date - timedelta(days=default_days), end_date
+    return date.fromisoformat(start_date), date.fromisoformat(end_date)
+
+def get_domain_from_url(url):
+    """Extract domain from URL"""
+    if not url:
+        return None
+    match = URL_NETLOC_RE.match(url)
+    return match.group(1) if match else ''
 
 def get_location_from_ip(ip_address):
     """
@@ -98,4 +175,67 @@ def get_location_from_ip(ip_address):
         'country': 'Unknown',
         'region': 'Unknown',
         'city': 'Unknown'
-    }
\ No newline at end of file
+    }
+
+def is_public_ip(ip_address):
+    """Whether an address can be geolocated by an external service"""
+    try:
+        return ipaddress.ip_address(ip_address).is_global
+    except ValueError:
+        return False
+
+def get_locations_for_ips(ip_addresses):
+    """
+    Get location info for many IP addresses at once.
+    Results are cached per IP for 24 hours; when ENABLE_IP_GEOLOCATION is on,
+    uncached public addresses are resolved through ip-api.com's batch
+    endpoint, 100 per request.
+    Returns a dict mapping each IP address to its location info.
+    """
+    ips = set(ip_addresses)
+    cache_keys = {f'geoip:{ip}': ip for ip in ips}
+    locations = {
+        cache_keys[key]: location
+        for key, location in cache.get_many(list(cache_keys)).items()
+    }
+    
+    # The external lookup is opt-in: it sends visitor addresses to a third party
+    if not settings.TRACKER_SETTINGS['ENABLE_IP_GEOLOCATION']:
+        missing = []
+    else:
+        missing = [ip for ip in ips - locations.keys() if is_public_ip(ip)]
+    resolved = {}
+    for start in range(0, len(missing), IP_API_BATCH_SIZE):
+        chunk = missing[start:start + IP_API_BATCH_SIZE]
+        try:
+            response = HTTP_SESSION.post(
+                IP_API_BATCH_URL,
+                json=chunk,
+                params={'fields': 'status,query,country,regionName,city,lat,lon'},
+                timeout=5,
+            )
+            response.raise_for_status()
+            for data in response.json():
+                if data.get('status') == 'success':
+                    resolved[data['query']] = {
+                        'country': data.get('country'),
+                        'region': data.get('regionName'),
+                        'city': data.get('city'),
+                        'latitude': data.get('lat'),
+                        'longitude': data.get('lon'),
+                    }
+        except (requests.RequestException, ValueError):
+            continue
+    
+    if resolved:
+        cache.set_many(
+            {f'geoip:{ip}': location for ip, location in resolved.items()},
+            GEOIP_CACHE_TIMEOUT
+        )
+    locations.update(resolved)
+    
+    # Local and unresolvable addresses get the single-address fallback
+    for ip in ips - locations.keys():
+        locations[ip] = get_location_from_ip(ip)
+    
+    return locations
@@ -1,25 +1,31 @@
 from rest_framework import viewsets, status
-from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.decorators import action, api_view, permission_classes, throttle_classes
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
-from django.db.models import Count, Avg, Q, F
-from django.db.models.functions import TruncDate
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connection, connections
+from django.db.models import Count, Avg, Q, F, Sum, DecimalField, FloatField, Func, Window
+from django.db.models.functions import Cast, Round, TruncDate
 from django.utils import timezone
-from datetime import datetime, timedelta
+from datetime import datetime, time, timedelta
 import json
-from django.core.cache import cache
+import msgspec
+from django.conf import settings
 from .models import Website, PageView, Session, Visitor, CustomEvent, DailyStats
 from .serializers import (
-    WebsiteSerializer, EventIngestionSerializer, PageViewAnalyticsSerializer,
+    WebsiteSerializer, PageViewAnalyticsSerializer,
     SessionAnalyticsSerializer, TrafficSourceSerializer, DeviceStatsSerializer,
-    BrowserStatsSerializer, GeographyStatsSerializer
+    BrowserStatsSerializer, GeographyStatsSerializer, decode_ingest_event
 )
-from .utils import parse_user_agent, get_traffic_source, get_location_from_ip
-from .batch_processor import BatchEventProcessor
+from .batch_processor import event_processor, get_website_id
+from .throttling import IngestRateThrottle
+from .cache import cached_analytics
+from .utils import get_date_range
 from django.shortcuts import render, get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.gzip import gzip_page
 from django.contrib.auth.decorators import login_required
-from .models import Website
 from django.http import HttpResponseForbidden
 from django.http import JsonResponse
 
@@ -32,177 +38,32 @@ class WebsiteViewSet(viewsets.ModelViewSet):
     
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
-@csrf_exempt
-@api_view(['POST'])
-@permission_classes([AllowAny])
-def ingest_event(request):
-    """
-    Event ingestion endpoint with validation and basic protections
-    """
-    serializer = EventIngestionSerializer(data=request.data)
-    if not serializer.is_valid():
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-    
-    data = serializer.validated_data
-    
-    try:
-        # Get website
-        website = Website.objects.get(
-            tracking_id=data['tracking_id'],
-            is_active=True
-        )
-        
-        # Get or create visitor
-        visitor, visitor_created = Visitor.objects.get_or_create(
-            website=website,
-            visitor_id=data['visitor_id'],
-            defaults={'is_returning': False}
-        )
-        
-        if not visitor_created:
-            visitor.is_returning = True
-            visitor.last_seen = timezone.now()
-            visitor.save()
-        
-        # Parse user agent for device/browser info
-        device_info = parse_user_agent(data.get('user_agent', ''))
-        
-        # Get location from IP
-        client_ip = get_client_ip(request)
-        location_info = get_location_from_ip(client_ip)
-        
-        # Get or create session
-        session, session_created = Session.objects.get_or_create(
-            website=website,
-            session_id=data['session_id'],
-            defaults={
-                'visitor': visitor,
-                'user_agent': data.get('user_agent', ''),
-                'device_type': device_info.get('device_type', 'unknown'),
-                'browser_name': device_info.get('browser_name', 'unknown'),
-                'browser_version': device_info.get('browser_version', 'unknown'),
-                'os_name': device_info.get('os_name', 'unknown'),
-                'os_version': device_info.get('os_version', 'unknown'),
-                'ip_address': client_ip,
-                'country': location_info.get('country'),
-                'region': location_info.get('region'),
-                'city': location_info.get('city'),
-            }
-        )
-        if not session_created and not session.country:
-            session.country = location_info.get('country')
-            session.region = location_info.get('region') 
-            session.city = location_info.get('city')
-            session.save()
-        
-        # Process event based on type
-        if data['event_type'] == 'pageview':
-            create_pageview(website, session, visitor, data, location_info)
-        elif data['event_type'] == 'custom':
-            create_custom_event(website, session, visitor, data)
-        
-        return Response({'status': 'success'}, status=status.HTTP_201_CREATED)
-        
-    except Website.DoesNotExist:
-        return Response(
-            {'error': 'Invalid tracking ID'}, 
-            status=status.HTTP_400_BAD_REQUEST
-        )
-    except Exception as e:
-        return Response(
-            {'error': 'Internal server error'}, 
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
-
-def create_pageview(website, session, visitor, data, location_info):
-    """Create a page view record"""
-    page_path = data['page_url'].split('?')[0] if data.get('page_url') else '/'
-    
-    # Determine traffic source
-    traffic_source = get_traffic_source(
-        data.get('referrer_url'),
-        data.get('utm_source'),
-        data.get('utm_medium')
-    )
-    
-    pageview = PageView.objects.create(
-        website=website,
-        session=session,
-        visitor=visitor,
-        page_url=data.get('page_url', ''),
-        page_title=data.get('page_title', ''),
-        page_path=page_path,
-        referrer_url=data.get('referrer_url'),
-        referrer_domain=get_domain_from_url(data.get('referrer_url')),
-        traffic_source=traffic_source,
-        utm_source=data.get('utm_source'),
-        utm_medium=data.get('utm_medium'),
-        utm_campaign=data.get('utm_campaign'),
-        utm_term=data.get('utm_term'),
-        utm_content=data.get('utm_content'),
-        screen_width=data.get('screen_width'),
-        screen_height=data.get('screen_height'),
-        viewport_width=data.get('viewport_width'),
-        viewport_height=data.get('viewport_height'),
-    )
-    
-    # Update session page views count
-    session.page_views = F('page_views') + 1
-    session.save()
-
-def create_custom_event(website, session, visitor, data):
-    """Create a custom event record"""
-    CustomEvent.objects.create(
-        website=website,
-        session=session,
-        visitor=visitor,
-        event_name=data.get('event_name', ''),
-        event_category=data.get('event_category'),
-        event_action=data.get('event_action'),
-        event_label=data.get('event_label'),
-        event_value=data.get('event_value'),
-        properties=data.get('properties', {}),
-    )
-
+@gzip_page
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@cached_analytics()
 def analytics_overview(request, website_id):
     """Get overview analytics for a website"""
     try:
-        website = Website.objects.get(id=website_id, owner=request.user)
+        website = Website.objects.only('id').get(id=website_id, owner=request.user)
         
         # Date range filtering
-        start_date = request.GET.get('start_date')
-        end_date = request.GET.get('end_date')
-        
-        if not start_date or not end_date:
-            end_date = timezone.now().date()
-            start_date = end_date - timedelta(days=30)
-        else:
-            start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-            end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
-        
-        # Basic metrics
-        total_page_views = PageView.objects.filter(
-            website=website,
-            timestamp__date__range=[start_date, end_date]
-        ).count()
-        
-        unique_visitors = Visitor.objects.filter(
-            website=website,
-            first_seen__date__range=[start_date, end_date]
-        ).count()
-        
-        total_sessions = Session.objects.filter(
-            website=website,
-            started_at__date__range=[start_date, end_date]
-        ).count()
+        start_date, end_date = get_date_range(request)
         
-        avg_session_duration = Session.objects.filter(
+        # Served from the daily rollup; today's row is refreshed every few minutes
+        totals = DailyStats.objects.filter(
             website=website,
-            started_at__date__range=[start_date, end_date],
-            duration_seconds__gt=0
-        ).aggregate(avg_duration=Avg('duration_seconds'))['avg_duration'] or 0
+            date__range=[start_date, end_date]
+        ).aggregate(
+            total_page_views=Sum('page_views'),
+            unique_visitors=Sum('unique_visitors'),
+            total_sessions=Sum('sessions'),
+            session_seconds=Sum(F('avg_session_duration') * F('sessions'))
+        )
+        total_page_views = totals['total_page_views'] or 0
+        unique_visitors = totals['unique_visitors'] or 0
+        total_sessions = totals['total_sessions'] or 0
+        avg_session_duration = (totals['session_seconds'] or 0) / total_sessions if total_sessions else 0
         
         return Response({
             'total_page_views': total_page_views,
@@ -221,38 +82,31 @@ def analytics_overview(request, website_id):
             status=status.HTTP_404_NOT_FOUND
         )
 
+@gzip_page
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@cached_analytics()
 def page_views_analytics(request, website_id):
     """Get page views analytics"""
     try:
-        website = Website.objects.get(id=website_id, owner=request.user)
+        website = Website.objects.only('id').get(id=website_id, owner=request.user)
         
-        start_date = request.GET.get('start_date')
-        end_date = request.GET.get('end_date')
+        start_date, end_date = get_date_range(request)
         
-        if not start_date or not end_date:
-            end_date = timezone.now().date()
-            start_date = end_date - timedelta(days=30)
-        else:
-            start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-            end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+        range_start, range_end = get_day_bounds(start_date, end_date)
         
-        # Daily page views trend
-        daily_stats = PageView.objects.filter(
+        # Daily page views trend, read from the rollup
+        daily_stats = DailyStats.objects.filter(
             website=website,
-            timestamp__date__range=[start_date, end_date]
-        ).extra(
-            select={'date': 'DATE(timestamp)'}
-        ).values('date').annotate(
-            page_views=Count('id'),
-            unique_page_views=Count('page_path', distinct=True)
-        ).order_by('date')
+            date__range=[start_date, end_date],
+            page_views__gt=0
+        ).values('date', 'page_views', 'unique_page_views').order_by('date')
         
         # Top pages
         top_pages = PageView.objects.filter(
             website=website,
-            timestamp__date__range=[start_date, end_date]
+            timestamp__gte=range_start,
+            timestamp__lt=range_end
         ).values('page_path', 'page_title').annotate(
             views=Count('id'),
             unique_views=Count('visitor', distinct=True)
@@ -269,33 +123,24 @@ def page_views_analytics(request, website_id):
             status=status.HTTP_404_NOT_FOUND
         )
 
+@gzip_page
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@cached_analytics()
 def sessions_analytics(request, website_id):
     """Get sessions analytics"""
     try:
-        website = Website.objects.get(id=website_id, owner=request.user)
-        
-        start_date = request.GET.get('start_date')
-        end_date = request.GET.get('end_date')
+        website = Website.objects.only('id').get(id=website_id, owner=request.user)
         
-        if not start_date or not end_date:
-            end_date = timezone.now().date()
-            start_date = end_date - timedelta(days=30)
-        else:
-            start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-            end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+        start_date, end_date = get_date_range(request)
         
-        # Daily sessions
-        daily_sessions = Session.objects.filter(
+        # Daily sessions, read from the rollup
+        daily_sessions = DailyStats.objects.filter(
             website=website,
-            started_at__date__range=[start_date, end_date]
-        ).extra(
-            select={'date': 'DATE(started_at)'}
-        ).values('date').annotate(
-            sessions=Count('id'),
-            avg_duration=Avg('duration_seconds'),
-            bounce_rate=Count('id', filter=Q(page_views=1)) * 100.0 / Count('id')
+            date__range=[start_date, end_date],
+            sessions__gt=0
+        ).values('date', 'sessions', 'bounce_rate').annotate(
+            avg_duration=F('avg_session_duration')
         ).order_by('date')
         
         return Response({
@@ -308,29 +153,26 @@ def sessions_analytics(request, website_id):
             status=status.HTTP_404_NOT_FOUND
         )
 
+@gzip_page
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@cached_analytics()
 def users_analytics(request, website_id):
     """Get new vs returning users analytics"""
     try:
-        website = Website.objects.get(id=website_id, owner=request.user)
+        website = Website.objects.only('id').get(id=website_id, owner=request.user)
         
-        start_date = request.GET.get('start_date')
-        end_date = request.GET.get('end_date')
+        start_date, end_date = get_date_range(request)
         
-        if not start_date or not end_date:
-            end_date = timezone.now().date()
-            start_date = end_date - timedelta(days=30)
-        else:
-            start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-            end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+        range_start, range_end = get_day_bounds(start_date, end_date)
         
         # Daily new vs returning users
         daily_users = Session.objects.filter(
             website=website,
-            started_at__date__range=[start_date, end_date]
-        ).extra(
-            select={'date': 'DATE(started_at)'}
+            started_at__gte=range_start,
+            started_at__lt=range_end
+        ).annotate(
+            date=TruncDate('started_at')
         ).values('date').annotate(
             new_users=Count('visitor', filter=Q(visitor__is_returning=False)),
             returning_users=Count('visitor', filter=Q(visitor__is_returning=True))
@@ -346,37 +188,29 @@ def users_analytics(request, website_id):
             status=status.HTTP_404_NOT_FOUND
         )
 
+@gzip_page
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@cached_analytics()
 def traffic_sources_analytics(request, website_id):
     """Get traffic sources analytics"""
     try:
-        website = Website.objects.get(id=website_id, owner=request.user)
+        website = Website.objects.only('id').get(id=website_id, owner=request.user)
         
-        start_date = request.GET.get('start_date')
-        end_date = request.GET.get('end_date')
+        start_date, end_date = get_date_range(request)
         
-        if not start_date or not end_date:
-            end_date = timezone.now().date()
-            start_date = end_date - timedelta(days=30)
-        else:
-            start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-            end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+        range_start, range_end = get_day_bounds(start_date, end_date)
         
         # Traffic sources
         sources = PageView.objects.filter(
             website=website,
-            timestamp__date__range=[start_date, end_date]
+            timestamp__gte=range_start,
+            timestamp__lt=range_end
         ).values('traffic_source').annotate(
-            sessions=Count('session', distinct=True)
+            sessions=Count('session', distinct=True),
+            percentage=percentage_of_total(Count('session', distinct=True))
         ).order_by('-sessions')
         
-        total_sessions = sum(item['sessions'] for item in sources)
-        
-        # Add percentage
-        for source in sources:
-            source['percentage'] = (source['sessions'] / total_sessions * 100) if total_sessions > 0 else 0
-        
         return Response({
             'traffic_sources': list(sources)
         })
@@ -387,50 +221,43 @@ def traffic_sources_analytics(request, website_id):
             status=status.HTTP_404_NOT_FOUND
         )
 
+@gzip_page
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@cached_analytics()
 def devices_analytics(request, website_id):
     """Get device analytics"""
     try:
-        website = Website.objects.get(id=website_id, owner=request.user)
+        website = Website.objects.only('id').get(id=website_id, owner=request.user)
         
-        start_date = request.GET.get('start_date')
-        end_date = request.GET.get('end_date')
+        start_date, end_date = get_date_range(request)
         
-        if not start_date or not end_date:
-            end_date = timezone.now().date()
-            start_date = end_date - timedelta(days=30)
-        else:
-            start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-            end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+        range_start, range_end = get_day_bounds(start_date, end_date)
         
         # Device types
         devices = Session.objects.filter(
             website=website,
-            started_at__date__range=[start_date, end_date]
+            started_at__gte=range_start,
+            started_at__lt=range_end
         ).values('device_type').annotate(
-            count=Count('id')
+            count=Count('id'),
+            percentage=percentage_of_total(Count('id'))
         ).order_by('-count')
         
-        # OS distribution
+        devices = list(devices)
+        
+        # OS distribution; every session has a device type, so no devices means no sessions
         os_stats = Session.objects.filter(
             website=website,
-            started_at__date__range=[start_date, end_date]
+            started_at__gte=range_start,
+            started_at__lt=range_end
         ).values('os_name').annotate(
-            count=Count('id')
-        ).order_by('-count')
-        
-        total_sessions = sum(item['count'] for item in devices)
-        
-        # Add percentage
-        for device in devices:
-            device['percentage'] = (device['count'] / total_sessions * 100) if total_sessions > 0 else 0
-        
-        for os in os_stats:
-            os['percentage'] = (os['count'] / total_sessions * 100) if total_sessions > 0 else 0
+            count=Count('id'),
+            percentage=percentage_of_total(Count('id'))
+        ).order_by('-count') if devices else []
         
         return Response({
-            'devices': list(devices),
+            'devices': devices,
             'operating_systems': list(os_stats)
         })
         
@@ -440,37 +267,29 @@ def devices_analytics(request, website_id):
             status=status.HTTP_404_NOT_FOUND
         )
 
+@gzip_page
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@cached_analytics()
 def browsers_analytics(request, website_id):
     """Get browser analytics"""
     try:
-        website = Website.objects.get(id=website_id, owner=request.user)
+        website = Website.objects.only('id').get(id=website_id, owner=request.user)
         
-        start_date = request.GET.get('start_date')
-        end_date = request.GET.get('end_date')
+        start_date, end_date = get_date_range(request)
         
-        if not start_date or not end_date:
-            end_date = timezone.now().date()
-            start_date = end_date - timedelta(days=30)
-        else:
-            start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-            end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+        range_start, range_end = get_day_bounds(start_date, end_date)
         
         # Browser distribution
         browsers = Session.objects.filter(
             website=website,
-            started_at__date__range=[start_date, end_date]
+            started_at__gte=range_start,
+            started_at__lt=range_end
         ).values('browser_name').annotate(
-            count=Count('id')
+            count=Count('id'),
+            percentage=percentage_of_total(Count('id'))
         ).order_by('-count')
         
-        total_sessions = sum(item['count'] for item in browsers)
-        
-        # Add percentage
-        for browser in browsers:
-            browser['percentage'] = (browser['count'] / total_sessions * 100) if total_sessions > 0 else 0
-        
         return Response({
             'browsers': list(browsers)
         })
@@ -481,45 +300,38 @@ def browsers_analytics(request, website_id):
             status=status.HTTP_404_NOT_FOUND
         )
 
+@gzip_page
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@cached_analytics()
 def geography_analytics(request, website_id):
     """Get geography analytics"""
     try:
-        website = Website.objects.get(id=website_id, owner=request.user)
+        website = Website.objects.only('id').get(id=website_id, owner=request.user)
         
-        start_date = request.GET.get('start_date')
-        end_date = request.GET.get('end_date')
+        start_date, end_date = get_date_range(request)
         
-        if not start_date or not end_date:
-            end_date = timezone.now().date()
-            start_date = end_date - timedelta(days=30)
-        else:
-            start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-            end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+        range_start, range_end = get_day_bounds(start_date, end_date)
         
         # Countries
         countries = Session.objects.filter(
             website=website,
-            started_at__date__range=[start_date, end_date]
+            started_at__gte=range_start,
+            started_at__lt=range_end
         ).exclude(country__isnull=True).values('country').annotate(
-            count=Count('id')
+            count=Count('id'),
+            percentage=percentage_of_total(Count('id'))
         ).order_by('-count')
         
         # Regions/Cities
         regions = Session.objects.filter(
             website=website,
-            started_at__date__range=[start_date, end_date]
+            started_at__gte=range_start,
+            started_at__lt=range_end
         ).exclude(region__isnull=True).values('country', 'region').annotate(
             count=Count('id')
         ).order_by('-count')[:20]
         
-        total_sessions = sum(item['count'] for item in countries)
-        
-        # Add percentage
-        for country in countries:
-            country['percentage'] = (country['count'] / total_sessions * 100) if total_sessions > 0 else 0
-        
         return Response({
             'countries': list(countries),
             'regions': list(regions)
@@ -533,6 +345,74 @@ def geography_analytics(request, website_id):
 
 
 # Helper functions
+class WindowSum(Func):
+    """SUM() that may wrap an aggregate, for use inside a Window"""
+    function = 'SUM'
+    window_compatible = True
+
+def percentage_of_total(aggregate):
+    """
+    Each grouped row's share of the grand total, rounded to one decimal and
+    computed in SQL with SUM(aggregate) OVER () instead of a second pass in Python
+    """
+    share = aggregate * 100.0 / Window(WindowSum(aggregate))
+    # PostgreSQL has no ROUND(double precision, int), so round it as numeric
+    return Cast(Round(Cast(share, DecimalField(max_digits=7, decimal_places=3)), 1), FloatField())
+
+def run_concurrently(queries, max_workers=None):
+    """
+    Evaluate independent queries on worker threads so their round-trips
+    overlap. Each value is a queryset (listed) or a callable (called). Every
+    worker opens one database connection, runs queries until none are left
+    and closes it when done. Workers default to ANALYTICS_QUERY_WORKERS, which
+    bounds the extra connections each request holds.
+    """
+    if max_workers is None:
+        max_workers = settings.TRACKER_SETTINGS['ANALYTICS_QUERY_WORKERS']
+    pending = deque(queries.items())
+    results = {}
+    
+    def work():
+        try:
+            configure_analytics_connection()
+            while True:
+                try:
+                    name, query = pending.popleft()
+                except IndexError:
+                    return
+                results[name] = query() if callable(query) else list(query)
+        finally:
+            connections.close_all()
+    
+    workers = min(max_workers, len(queries))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(work) for _ in range(workers)]
+    for future in futures:
+        future.result()
+    return {name: results[name] for name in queries}
+
+def configure_analytics_connection():
+    """
+    Bound how long any one analytics statement may run, and skip JIT
+    compilation, which costs more than these short aggregates gain from it
+    """
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT set_config('statement_timeout', %s, false), set_config('jit', 'off', false)",
+            [str(settings.TRACKER_SETTINGS['ANALYTICS_STATEMENT_TIMEOUT_MS'])]
+        )
+
+def get_day_bounds(start_date, end_date):
+    """
+    Half-open datetime range covering whole local days from start_date to
+    end_date, so filters compare the raw column and can use its indexes
+    """
+    range_start = timezone.make_aware(datetime.combine(start_date, time.min))
+    range_end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min))
+    return range_start, range_end
+
 def get_client_ip(request):
     """Get client IP address from request"""
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
@@ -542,46 +422,37 @@ def get_client_ip(request):
         ip = request.META.get('REMOTE_ADDR')
     return ip
 
-def get_domain_from_url(url):
-    """Extract domain from URL"""
-    if not url:
-        return None
-    try:
-        from urllib.parse import urlparse
-        return urlparse(url).netloc
-    except:
-        return None
+@csrf_exempt
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([IngestRateThrottle])
 def ingest_event_optimized(request):
     """
     Optimized event ingestion with batching and caching
     """
-    serializer = EventIngestionSerializer(data=request.data)
-    if not serializer.is_valid():
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    # Reject oversized payloads before reading or decoding them. The declared
+    # length can be missing (chunked uploads), so cap what is actually read too.
+    max_bytes = settings.TRACKER_SETTINGS['MAX_EVENT_BYTES']
+    if int(request.META.get('CONTENT_LENGTH') or 0) > max_bytes:
+        return Response({'error': 'Payload too large'}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    body = request.read(max_bytes + 1)
+    if len(body) > max_bytes:
+        return Response({'error': 'Payload too large'}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
     
-    data = serializer.validated_data
+    try:
+        data = decode_ingest_event(body)
+    except msgspec.DecodeError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
-    # Validate tracking ID from cache first
-    cache_key = f"website:{data['tracking_id']}"
-    website_exists = cache.get(cache_key)
-    if website_exists is None:
-        try:
-            Website.objects.get(tracking_id=data['tracking_id'], is_active=True)
-            cache.set(cache_key, True, timeout=3600)  # Cache for 1 hour
-        except Website.DoesNotExist:
-            cache.set(cache_key, False, timeout=300)  # Cache negative result for 5 minutes
-            return Response({'error': 'Invalid tracking ID'}, status=status.HTTP_400_BAD_REQUEST)
-    elif website_exists is False:
-        return Response({'error': 'Invalid tracking ID'}, status=status.HTTP_400_BAD_REQUEST)
+    # Validate tracking ID against the shared cache; the id rides along with the event
+    try:
+        data['website_id'] = get_website_id(str(data['tracking_id']))
+    except Website.DoesNotExist:
         return Response({'error': 'Invalid tracking ID'}, status=status.HTTP_400_BAD_REQUEST)
     
-    # Add client IP and processing metadata
+    # Add client IP; prepare_event stamps the queue time
     data['client_ip'] = get_client_ip(request)
-    data['received_at'] = timezone.now().isoformat()
-    processor = BatchEventProcessor()
-    success = processor.queue_event(data)
+    success = event_processor.queue_event(data)
     
     if success:
         return Response({'status': 'queued'}, status=status.HTTP_202_ACCEPTED)
@@ -673,8 +544,102 @@ def debug_ingest(request):
             'details': str(e)
         }, status=500)
 
+# Top-N session breakdowns as name: (grouped fields, row limit or None,
+# whether rows with a blank last field are dropped)
+SESSION_BREAKDOWNS = {
+    'device_stats': (('device_type',), None, False),
+    'os_stats': (('os_name',), 10, False),
+    'browser_stats': (('browser_name', 'browser_version'), 10, False),
+    'browser_families': (('browser_name',), 10, False),
+    'countries': (('country',), 20, True),
+    'regions': (('country', 'region'), 15, True),
+    'cities': (('country', 'region', 'city'), 15, True),
+}
+
+def get_session_breakdowns(sessions_qs):
+    """
+    Session counts for every SESSION_BREAKDOWNS entry, keyed by name. On
+    PostgreSQL all of them come from one scan with GROUPING SETS, ranked
+    with ROW_NUMBER() so only each breakdown's top rows are returned; other
+    databases run one grouped query per breakdown.
+    """
+    if connection.vendor != 'postgresql':
+        breakdowns = {}
+        for name, (fields, limit, skip_blank) in SESSION_BREAKDOWNS.items():
+            queryset = sessions_qs
+            if skip_blank:
+                queryset = queryset.exclude(Q(**{fields[-1]: ''}) | Q(**{f'{fields[-1]}__isnull': True}))
+            rows = queryset.values(*fields).annotate(count=Count('id')).order_by('-count')
+            breakdowns[name] = list(rows[:limit] if limit else rows)
+        return breakdowns
+    
+    columns = list(dict.fromkeys(
+        field for fields, _, _ in SESSION_BREAKDOWNS.values() for field in fields
+    ))
+    # GROUPING() sets a bit, most significant first, for each column left out of the row's set
+    mask_of = {
+        name: sum(1 << (len(columns) - 1 - i) for i, column in enumerate(columns) if column not in fields)
+        for name, (fields, _, _) in SESSION_BREAKDOWNS.items()
+    }
+    names = {mask: name for name, mask in mask_of.items()}
+    
+    inner_sql, params = sessions_qs.values(*columns).query.sql_with_params()
+    column_list = ', '.join(columns)
+    grouping_sets = ', '.join(
+        f"({', '.join(fields)})" for fields, _, _ in SESSION_BREAKDOWNS.values()
+    )
+    # Blank groups are dropped before ranking so they never take a top-N slot
+    blank_filters = ' AND '.join(
+        f"NOT (grouping_id = {mask_of[name]} AND COALESCE({fields[-1]}, '') = '')"
+        for name, (fields, _, skip_blank) in SESSION_BREAKDOWNS.items() if skip_blank
+    ) or 'TRUE'
+    rank_filters = ' OR '.join(
+        f"(grouping_id = {mask_of[name]} AND row_rank <= {limit})" if limit
+        else f"grouping_id = {mask_of[name]}"
+        for name, (_, limit, _) in SESSION_BREAKDOWNS.items()
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT grouping_id, {column_list}, group_count FROM ("
+            f"SELECT *, ROW_NUMBER() OVER (PARTITION BY grouping_id ORDER BY group_count DESC) AS row_rank FROM ("
+            f"SELECT GROUPING({column_list}) AS grouping_id, {column_list}, COUNT(*) AS group_count "
+            f"FROM ({inner_sql}) AS sessions GROUP BY GROUPING SETS ({grouping_sets})"
+            f") AS grouped WHERE {blank_filters}"
+            f") AS ranked WHERE {rank_filters} ORDER BY grouping_id, row_rank",
+            params
+        )
+        rows = cursor.fetchall()
+    
+    breakdowns = {name: [] for name in SESSION_BREAKDOWNS}
+    for mask, *values, count in rows:
+        name = names[mask]
+        row = dict(zip(columns, values))
+        breakdowns[name].append({
+            **{field: row[field] for field in SESSION_BREAKDOWNS[name][0]},
+            'count': count
+        })
+    return breakdowns
+
+def add_percentages(rows):
+    """Give each grouped row its share of the listed rows' total count"""
+    total = sum(row['count'] for row in rows)
+    for row in rows:
+        row['percentage'] = round(row['count'] / total * 100, 1)
+    return rows
+
+# Session duration buckets as (label, min seconds, max seconds or None)
+DURATION_RANGES = [
+    ('0-30s', 0, 30),
+    ('30s-1m', 31, 60),
+    ('1-3m', 61, 180),
+    ('3-10m', 181, 600),
+    ('10m+', 601, None)
+]
+
+@gzip_page
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@cached_analytics()
 def comprehensive_analytics(request, website_id):
     """
     Get comprehensive analytics data for a website including:
@@ -687,7 +652,11 @@ def comprehensive_analytics(request, website_id):
     - Browser distribution
     - Geography distribution
     """
-    website = get_object_or_404(Website, id=website_id, owner=request.user)
+    website = get_object_or_404(
+        Website.objects.only('id', 'name', 'domain', 'tracking_id'),
+        id=website_id,
+        owner=request.user
+    )
     
     # Get date range from query parameters (default to last 30 days)
     days = int(request.GET.get('days', 30))
@@ -720,24 +689,41 @@ def comprehensive_analytics(request, website_id):
     )
     
     # 1. OVERVIEW STATS
-    total_pageviews = pageviews_qs.count()
-    total_sessions = sessions_qs.count()
-    total_visitors = visitors_qs.count()
-    total_custom_events = custom_events_qs.count()
-    
-    avg_session_duration = sessions_qs.aggregate(
-        avg_duration=Avg('duration_seconds')
-    )['avg_duration'] or 0
+    # Each total is counted together with its realtime (last hour) share
+    last_hour = end_date - timedelta(hours=1)
+    pageview_totals = lambda: pageviews_qs.aggregate(
+        total=Count('id'),
+        recent=Count('id', filter=Q(timestamp__gte=last_hour))
+    )
+    custom_event_totals = lambda: custom_events_qs.aggregate(
+        total=Count('id'),
+        recent=Count('id', filter=Q(timestamp__gte=last_hour))
+    )
     
-    # Bounce rate (sessions with only 1 pageview)
-    bounced_sessions = sessions_qs.filter(page_views=1).count()
-    bounce_rate = (bounced_sessions / total_sessions * 100) if total_sessions > 0 else 0
+    # Session count, average duration, bounces (sessions with only 1
+    # pageview), new vs returning users and the session duration
+    # distribution buckets in one pass over the sessions
+    session_totals = lambda: sessions_qs.aggregate(
+        **{
+            f"duration_bucket_{index}": Count('id', filter=(
+                Q(duration_seconds__gte=min_duration) if max_duration is None
+                else Q(duration_seconds__gte=min_duration, duration_seconds__lte=max_duration)
+            ))
+            for index, (_, min_duration, max_duration) in enumerate(DURATION_RANGES)
+        },
+        total_sessions=Count('id'),
+        avg_duration=Avg('duration_seconds'),
+        bounced_sessions=Count('id', filter=Q(page_views=1)),
+        active_sessions=Count('id', filter=Q(started_at__gte=last_hour)),
+        new_users=Count('visitor', filter=Q(visitor__is_returning=False), distinct=True),
+        returning_users=Count('visitor', filter=Q(visitor__is_returning=True), distinct=True)
+    )
     
     # 2. PAGE VIEWS TREND AND TOP PAGES
     # Daily pageview trend
     pageviews_trend = (
         pageviews_qs
-        .extra({'date': "date(timestamp)"})
+        .annotate(date=TruncDate('timestamp'))
         .values('date')
         .annotate(
             views=Count('id'),
@@ -757,67 +743,30 @@ def comprehensive_analytics(request, website_id):
         .order_by('-views')[:10]
     )
     
-    # 3. SESSIONS TREND AND DURATION
-    sessions_trend = (
+    # 3-4. SESSIONS TREND, DURATION AND NEW VS RETURNING USERS
+    # Totals come from session_totals; the daily sessions trend and the
+    # daily new vs returning trend share one grouped scan
+    session_days = (
     sessions_qs
     .annotate(date=TruncDate('started_at'))
     .values('date')
     .annotate(
         sessions=Count('id'),
-        avg_duration=Avg('duration_seconds')
-    )
-    .order_by('date')   
-    )
-  
-    # Session duration distribution
-    duration_ranges = [
-        ('0-30s', 0, 30),
-        ('30s-1m', 31, 60),
-        ('1-3m', 61, 180),
-        ('3-10m', 181, 600),
-        ('10m+', 601, float('inf'))
-    ]
-    
-    duration_distribution = []
-    for label, min_duration, max_duration in duration_ranges:
-        if max_duration == float('inf'):
-            count = sessions_qs.filter(duration_seconds__gte=min_duration).count()
-        else:
-            count = sessions_qs.filter(
-                duration_seconds__gte=min_duration,
-                duration_seconds__lte=max_duration
-            ).count()
-        
-        percentage = (count / total_sessions * 100) if total_sessions > 0 else 0
-        duration_distribution.append({
-            'range': label,
-            'count': count,
-            'percentage': round(percentage, 1)
-        })
-    
-    # 4. NEW VS RETURNING USERS
-    # Users by type
-    new_users = sessions_qs.filter(visitor__is_returning=False).values('visitor').distinct().count()
-    returning_users = sessions_qs.filter(visitor__is_returning=True).values('visitor').distinct().count()
-    # Daily new vs returning trend
-    
-    users_trend = (
-    sessions_qs
-    .annotate(date=TruncDate('started_at'))
-    .values('date')
-    .annotate(
+        avg_duration=Avg('duration_seconds'),
         new_users=Count('visitor', filter=Q(visitor__is_returning=False), distinct=True),
         returning_users=Count('visitor', filter=Q(visitor__is_returning=True), distinct=True)
     )
-    .order_by('date')
+    .order_by('date')   
     )
-    users_trend = list(users_trend)
     
     # 5. TRAFFIC SOURCES
     traffic_sources = (
         pageviews_qs
         .values('traffic_source')
-        .annotate(count=Count('id'))
+        .annotate(
+            count=Count('id'),
+            percentage=percentage_of_total(Count('id'))
+        )
         .order_by('-count')
     )
     
@@ -841,100 +790,85 @@ def comprehensive_analytics(request, website_id):
         .order_by('-count')[:10]
     )
     
-    # 6. DEVICE DISTRIBUTION
-    device_stats = (
-        sessions_qs
-        .values('device_type')
-        .annotate(count=Count('id'))
-        .order_by('-count')
-    )
-    
-    # OS distribution
-    os_stats = (
-        sessions_qs
-        .values('os_name')
-        .annotate(count=Count('id'))
-        .order_by('-count')[:10]
-    )
+    # 6-8. DEVICE, BROWSER AND GEOGRAPHY DISTRIBUTION
+    # Every session breakdown comes out of a single scan; the rows are
+    # already in Python, so their pie chart percentages are added there
+    session_breakdowns = lambda: {
+        name: add_percentages(rows) for name, rows in get_session_breakdowns(sessions_qs).items()
+    }
     
-    # 7. BROWSER DISTRIBUTION
-    browser_stats = (
-        sessions_qs
-        .values('browser_name', 'browser_version')
+    # 9. CUSTOM EVENTS
+    popular_events = (
+        custom_events_qs
+        .values('event_name', 'event_category')
         .annotate(count=Count('id'))
         .order_by('-count')[:10]
     )
     
-    # Browser families (without version)
-    browser_families = (
-        sessions_qs
-        .values('browser_name')
-        .annotate(count=Count('id'))
-        .order_by('-count')[:10]
-    )
+    # The queries above are independent, so run them side by side
+    results = run_concurrently({
+        'pageview_totals': pageview_totals,
+        'total_visitors': visitors_qs.count,
+        'custom_event_totals': custom_event_totals,
+        'session_totals': session_totals,
+        'pageviews_trend': pageviews_trend,
+        'top_pages': top_pages,
+        'session_days': session_days,
+        'traffic_sources': traffic_sources,
+        'utm_sources': utm_sources,
+        'referrer_domains': referrer_domains,
+        'session_breakdowns': session_breakdowns,
+        'popular_events': popular_events,
+    })
     
-    # 8. GEOGRAPHY DISTRIBUTION
-    countries = (
-        sessions_qs
-        .exclude(country='')
-        .exclude(country__isnull=True)
-        .values('country')
-        .annotate(count=Count('id'))
-        .order_by('-count')[:20]
-    )
+    results.update(results.pop('session_breakdowns'))
+    total_pageviews = results['pageview_totals']['total']
+    total_visitors = results['total_visitors']
+    total_custom_events = results['custom_event_totals']['total']
+    total_sessions = results['session_totals']['total_sessions']
+    avg_session_duration = results['session_totals']['avg_duration'] or 0
+    bounced_sessions = results['session_totals']['bounced_sessions']
+    bounce_rate = (bounced_sessions / total_sessions * 100) if total_sessions > 0 else 0
+    new_users = results['session_totals']['new_users']
+    returning_users = results['session_totals']['returning_users']
     
-    regions = (
-        sessions_qs
-        .exclude(region='')
-        .exclude(region__isnull=True)
-        .values('country', 'region')
-        .annotate(count=Count('id'))
-        .order_by('-count')[:15]
-    )
+    sessions_trend = [
+        {'date': day['date'], 'sessions': day['sessions'], 'avg_duration': day['avg_duration']}
+        for day in results['session_days']
+    ]
+    users_trend = [
+        {'date': day['date'], 'new_users': day['new_users'], 'returning_users': day['returning_users']}
+        for day in results['session_days']
+    ]
     
-    cities = (
-        sessions_qs
-        .exclude(city='')
-        .exclude(city__isnull=True)
-        .values('country', 'region', 'city')
-        .annotate(count=Count('id'))
-        .order_by('-count')[:15]
-    )
+    duration_distribution = []
+    for index, (label, _, _) in enumerate(DURATION_RANGES):
+        count = results['session_totals'][f"duration_bucket_{index}"]
+        percentage = (count / total_sessions * 100) if total_sessions > 0 else 0
+        duration_distribution.append({
+            'range': label,
+            'count': count,
+            'percentage': round(percentage, 1)
+        })
     
-    # 9. REAL-TIME DATA (last hour)
-    last_hour = timezone.now() - timedelta(hours=1)
+    # 10. REAL-TIME DATA (last hour)
     realtime_data = {
-        'active_users': sessions_qs.filter(started_at__gte=last_hour).count(),
-        'current_pageviews': pageviews_qs.filter(timestamp__gte=last_hour).count(),
-        'recent_events': custom_events_qs.filter(timestamp__gte=last_hour).count()
+        'active_users': results['session_totals']['active_sessions'],
+        'current_pageviews': results['pageview_totals']['recent'],
+        'recent_events': results['custom_event_totals']['recent']
     }
     
-    # 10. CUSTOM EVENTS
-    popular_events = (
-        custom_events_qs
-        .values('event_name', 'event_category')
-        .annotate(count=Count('id'))
-        .order_by('-count')[:10]
-    )
-    
-    # Calculate percentages for pie charts
-    def add_percentages(data_list, count_field='count'):
-        total = sum(item[count_field] for item in data_list)
-        for item in data_list:
-            item['percentage'] = round((item[count_field] / total * 100) if total > 0 else 0, 1)
-        return data_list
-    
     # Build comprehensive response
     analytics_data = {
         'website': {
-            'id': str(website.id),
+            'id': website.id,
             'name': website.name,
             'domain': website.domain,
-            'tracking_id': str(website.tracking_id)
+            'tracking_id': website.tracking_id
         },
         'date_range': {
-            'start': start_date.date().isoformat(),
-            'end': end_date.date().isoformat(),
+            'start': start_date.date(),
+            'end': end_date.date(),
             'days': days
         },
         'overview': {
@@ -947,11 +881,11 @@ def comprehensive_analytics(request, website_id):
             'pages_per_session': round((total_pageviews / total_sessions) if total_sessions > 0 else 0, 2)
         },
         'pageviews': {
-            'trend': list(pageviews_trend),
-            'top_pages': list(top_pages)
+            'trend': results['pageviews_trend'],
+            'top_pages': results['top_pages']
         },
         'sessions': {
-            'trend': list(sessions_trend),
+            'trend': sessions_trend,
             'duration_distribution': duration_distribution
         },
         'users': {
@@ -964,26 +898,26 @@ def comprehensive_analytics(request, website_id):
             'trend': users_trend
         },
         'traffic_sources': {
-            'sources': add_percentages(list(traffic_sources)),
-            'utm_campaigns': list(utm_sources),
-            'referrer_domains': list(referrer_domains)
+            'sources': results['traffic_sources'],
+            'utm_campaigns': results['utm_sources'],
+            'referrer_domains': results['referrer_domains']
         },
         'devices': {
-            'device_types': add_percentages(list(device_stats)),
-            'operating_systems': add_percentages(list(os_stats))
+            'device_types': results['device_stats'],
+            'operating_systems': results['os_stats']
         },
         'browsers': {
-            'browser_versions': list(browser_stats),
-            'browser_families': add_percentages(list(browser_families))
+            'browser_versions': results['browser_stats'],
+            'browser_families': results['browser_families']
         },
         'geography': {
-            'countries': add_percentages(list(countries)),
-            'regions': list(regions),
-            'cities': list(cities)
+            'countries': results['countries'],
+            'regions': results['regions'],
+            'cities': results['cities']
         },
         'realtime': realtime_data,
         'custom_events': {
-            'popular_events': list(popular_events)
+            'popular_events': results['popular_events']
         }
     }
     
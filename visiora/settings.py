@@ -104,8 +104,15 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'tracker.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 50,
+    # Reverse proxies in front of the app; throttles only trust that many
+    # X-Forwarded-For hops (0 means key on REMOTE_ADDR)
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', '0')),
 }
 
 # JWT Settings
@@ -162,6 +169,14 @@ AUTH_USER_MODEL = 'accounts.CustomUser'
 # Redis configuration (optional)
 REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
 
+# Shared cache so lookups cached by one worker are visible to all of them
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    }
+}
+
 # Celery configuration (for background tasks)
 CELERY_BROKER_URL = REDIS_URL
 CELERY_RESULT_BACKEND = REDIS_URL
@@ -170,14 +185,20 @@ CELERY_RESULT_BACKEND = REDIS_URL
 TRACKER_SETTINGS = {
     'SESSION_TIMEOUT_MINUTES': 30,
     'BATCH_SIZE': 1000,
+    'MAX_EVENT_RETRIES': 5,  # Attempts before an event is moved to the dead-letter list
     'ENABLE_REAL_TIME': True,
+    'ENABLE_IP_GEOLOCATION': False,  # Look up visitor IPs on ip-api.com
+    'INGEST_RATE_LIMIT': 600,  # Events per client address per minute
+    'MAX_EVENT_BYTES': 16384,  # Larger ingest payloads are rejected unread
+    'ANALYTICS_STATEMENT_TIMEOUT_MS': 8000,  # Per statement, on analytics read connections
+    'ANALYTICS_QUERY_WORKERS': 3,  # Extra database connections per uncached comprehensive request
 }
 
 
 CELERY_BEAT_SCHEDULE = {
     'process-event-batches': {
         'task': 'tracker.tasks.process_event_batches',
-        'schedule': 30.0,  # Every 30 seconds
+        'schedule': 1.0,  # Every second; ingestion only enqueues
     },
     'monitor-websites': {
         'task': 'tracker.tasks.monitor_websites',
@@ -187,6 +208,10 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'tracker.tasks.aggregate_daily_stats',
         'schedule': crontab(hour=1, minute=0),  # Daily at 1 AM
     },
+    'aggregate-today-stats': {
+        'task': 'tracker.tasks.aggregate_today_stats',
+        'schedule': crontab(minute='*/10'),  # Every 10 minutes
+    },
     'cleanup-old-data': {
         'task': 'tracker.tasks.cleanup_old_data',
         'schedule': crontab(hour=2, minute=0, day_of_week=0),  # Weekly on Sunday at 2 AM